@@ -0,0 +1,104 @@
+"""Buffered audit log writer."""
+import asyncio
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import insert
+
+from database import AuditLog, db_writer
+from config import settings
+from events import event_bus
+from metrics import AUDIT_ENTRIES, AUDIT_FLUSH_SECONDS
+
+
+class AuditSink:
+    """Buffer audit entries in memory and write them in bulk inserts.
+
+    Entries are flushed when AUDIT_FLUSH_SIZE of them are buffered or every
+    AUDIT_FLUSH_INTERVAL seconds, whichever comes first, through the DB
+    write queue. Entries of a failed write (e.g. "database is locked") go
+    back to the front of the buffer and are retried on the next flush;
+    beyond AUDIT_BUFFER_MAX entries the oldest are dropped. `stop` drains
+    the buffer on shutdown.
+    """
+
+    def __init__(self):
+        self.buffer: list = []
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def add(self, entry: dict):
+        """Buffer an entry, flushing when the buffer is full."""
+        self.buffer.append(entry)
+        if len(self.buffer) >= settings.AUDIT_FLUSH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        """Write buffered entries in one bulk insert."""
+        async with self._lock:
+            if not self.buffer:
+                return
+            rows, self.buffer = self.buffer, []
+            try:
+                with AUDIT_FLUSH_SECONDS.time():
+                    result = await db_writer.submit(lambda db: db.execute(
+                        insert(AuditLog).returning(AuditLog.id, sort_by_parameter_order=True), rows
+                    ))
+            except Exception as e:
+                self.buffer = rows + self.buffer
+                overflow = len(self.buffer) - settings.AUDIT_BUFFER_MAX
+                if overflow > 0:
+                    del self.buffer[:overflow]
+                print(
+                    f"[Audit] Failed to write {len(rows)} entries, will retry: {e}"
+                    + (f" ({overflow} oldest dropped)" if overflow > 0 else "")
+                )
+                return
+            for row_id, row in zip(result.scalars().all(), rows):
+                event_bus.publish("log", {
+                    "id": row_id,
+                    "record_id": row["record_id"],
+                    "action": row["action"],
+                    "status": row["status"],
+                    "message": row["message"],
+                    "created_at": row["created_at"].isoformat(),
+                })
+
+    async def run(self):
+        """Periodic flush loop."""
+        while True:
+            await asyncio.sleep(settings.AUDIT_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self):
+        """Start the periodic flush task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the flush task and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+audit_sink = AuditSink()
+
+
+async def log_audit(
+    record_id: Optional[int],
+    action: str,
+    status: str,
+    message: str,
+    details: Optional[str] = None
+):
+    """Log audit entry."""
+    AUDIT_ENTRIES.labels(action, status).inc()
+    await audit_sink.add({
+        "record_id": record_id,
+        "action": action,
+        "status": status,
+        "message": message,
+        "details": details,
+        "created_at": datetime.utcnow(),
+    })
@@ -1,27 +1,103 @@
 """Authentication and authorization."""
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 import bcrypt
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, event
 
 from database import get_db, User
 from config import settings
+from resilience import RateLimiter
 
 security = HTTPBearer()
 
 
-def hash_password(password: str) -> str:
+# bcrypt is deliberately slow; it runs here so logins never block the event loop
+_bcrypt_executor = ThreadPoolExecutor(
+    max_workers=settings.BCRYPT_WORKERS, thread_name_prefix="bcrypt"
+)
+
+
+def _hash_password(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+async def hash_password(password: str) -> str:
     """Hash a password."""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_executor, _hash_password, password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password."""
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _bcrypt_executor, _verify_password, plain_password, hashed_password
+    )
+
+
+# Login attempts per client IP and per username
+login_limiter = RateLimiter(
+    rate=settings.LOGIN_RATE_PER_MINUTE / 60,
+    burst=settings.LOGIN_BURST
+)
+
+_trusted_proxies = {ip.strip() for ip in settings.TRUSTED_PROXIES.split(",") if ip.strip()}
+
+
+def is_local_peer(request: Request) -> bool:
+    """Check whether the request comes straight from this host or a trusted proxy."""
+    return bool(request.client) and request.client.host in _trusted_proxies
+
+
+def client_ip(request: Request) -> str:
+    """Client address, taken from X-Real-IP when the request came through nginx."""
+    host = request.client.host if request.client else "unknown"
+    if host in _trusted_proxies:
+        return request.headers.get("x-real-ip", host)
+    return host
+
+
+def _login_keys(request: Request, username: str) -> tuple:
+    return f"ip:{client_ip(request)}", f"user:{username.lower()}"
+
+
+def check_login_rate(request: Request, username: str):
+    """Take a login attempt for the client IP and the username, raising 429 when out.
+
+    The attempt is given back by refund_login_rate() once the login
+    succeeds, so only failed attempts use up the budget.
+    """
+    taken = []
+    for key in _login_keys(request, username):
+        if not login_limiter.allow(key):
+            for taken_key in taken:
+                login_limiter.refund(taken_key)
+            retry_after = max(int(login_limiter.retry_after(key)) + 1, 1)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, try again later",
+                headers={"Retry-After": str(retry_after)},
+            )
+        taken.append(key)
+
+
+def refund_login_rate(request: Request, username: str):
+    """Give back the attempt taken by check_login_rate() for a successful login."""
+    for key in _login_keys(request, username):
+        login_limiter.refund(key)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -36,6 +112,90 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+class TokenCache:
+    """TTL/LRU cache of verified tokens -> user principal.
+
+    A cached token skips both the signature check and the users lookup.
+    Entries live AUTH_CACHE_TTL seconds at most (never past the token's
+    own expiry) and are dropped as soon as the user row is updated or
+    deleted in this process.
+    """
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[User]:
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[token]
+            return None
+        self.entries.move_to_end(token)
+        return user
+
+    def put(self, token: str, user: User, token_exp: Optional[int]):
+        ttl = self.ttl
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+        self.entries[token] = (time.monotonic() + ttl, user)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        """Drop all cached tokens of a user."""
+        for token, (_, user) in list(self.entries.items()):
+            if user.username == username:
+                del self.entries[token]
+
+    def clear(self):
+        self.entries.clear()
+
+
+token_cache = TokenCache(settings.AUTH_CACHE_TTL, settings.AUTH_CACHE_SIZE)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_tokens(mapper, connection, target):
+    token_cache.invalidate_user(target.username)
+
+
+async def authenticate_token(token: str, db: AsyncSession) -> Optional[User]:
+    """Get the user a JWT belongs to, or None if it is invalid.
+
+    The returned User is detached (id, username and role only).
+    """
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            return None
+    except JWTError:
+        return None
+    
+    result = await db.execute(
+        select(User.id, User.username, User.role).where(User.username == username)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+    
+    user = User(id=row.id, username=row.username, role=row.role)
+    token_cache.put(token, user, payload.get("exp"))
+    return user
+
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db)
@@ -47,18 +207,7 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
-    
+    user = await authenticate_token(credentials.credentials, db)
     if user is None:
         raise credentials_exception
     
@@ -73,7 +222,7 @@ async def init_admin_user(db: AsyncSession):
     if not admin:
         admin = User(
             username=settings.ADMIN_USERNAME,
-            password_hash=hash_password(settings.ADMIN_PASSWORD),
+            password_hash=await hash_password(settings.ADMIN_PASSWORD),
             role="administrator"
         )
         db.add(admin)
@@ -9,11 +9,45 @@ class Settings:
     # Database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:////data/lis.db")
     
+    # PostgreSQL connection pool (ignored for SQLite)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds
+    
+    # SQLite tuning
+    SQLITE_BUSY_TIMEOUT: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # ms
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB
+    
+    # Write path
+    DB_WRITE_BATCH_SIZE: int = int(os.getenv("DB_WRITE_BATCH_SIZE", "100"))  # mutations per transaction
+    AUDIT_FLUSH_SIZE: int = int(os.getenv("AUDIT_FLUSH_SIZE", "50"))  # entries
+    AUDIT_FLUSH_INTERVAL: float = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))  # seconds
+    AUDIT_BUFFER_MAX: int = int(os.getenv("AUDIT_BUFFER_MAX", "10000"))  # entries kept while writes fail
+    
     # NAS Paths
     NAS_WATCH_PATH: str = os.getenv("NAS_WATCH_PATH", "/mnt/nas/lab_results")
     NAS_ARCHIVE_PATH: str = os.getenv("NAS_ARCHIVE_PATH", "/mnt/nas/archive")
     NAS_QUARANTINE_PATH: str = os.getenv("NAS_QUARANTINE_PATH", "/mnt/nas/quarantine")
     WATCH_INTERVAL: int = int(os.getenv("WATCH_INTERVAL", "30"))  # seconds
+    WATCH_MODE: str = os.getenv("WATCH_MODE", "events")  # events, polling
+    # CIFS does not report writes made by other hosts: the reconcile scan is
+    # what detects them there, so it must not be slower than polling
+    WATCH_RECONCILE_INTERVAL: int = int(os.getenv("WATCH_RECONCILE_INTERVAL", str(WATCH_INTERVAL)))  # seconds
+    WATCH_STABLE_SECONDS: float = float(os.getenv("WATCH_STABLE_SECONDS", "2"))  # seconds without size/mtime change
+    WATCH_STABLE_CHECK_INTERVAL: float = float(os.getenv("WATCH_STABLE_CHECK_INTERVAL", "0.5"))  # seconds
+    
+    # Hashing
+    HASH_EXECUTOR: str = os.getenv("HASH_EXECUTOR", "thread")  # thread, process
+    HASH_WORKERS: int = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    HASH_BUFFER_SIZE: int = int(os.getenv("HASH_BUFFER_SIZE", str(1024 * 1024)))  # bytes
+    
+    # Ingest pipeline
+    INGEST_QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", "100"))
+    INGEST_HASH_WORKERS: int = int(os.getenv("INGEST_HASH_WORKERS", str(HASH_WORKERS)))
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "50"))
     
     # 1C API
     API_1C_URL: str = os.getenv("API_1C_URL", "https://1c.example.ru/lab/attachResult")
@@ -21,6 +55,26 @@ class Settings:
     API_1C_TIMEOUT: int = int(os.getenv("API_1C_TIMEOUT", "30"))
     API_1C_RETRY_COUNT: int = int(os.getenv("API_1C_RETRY_COUNT", "3"))
     API_1C_RETRY_DELAY: int = int(os.getenv("API_1C_RETRY_DELAY", "5"))  # seconds
+    API_1C_RETRY_MAX_DELAY: int = int(os.getenv("API_1C_RETRY_MAX_DELAY", "600"))  # seconds
+    API_1C_MAX_IN_FLIGHT: int = int(os.getenv("API_1C_MAX_IN_FLIGHT", "4"))
+    API_1C_MIN_IN_FLIGHT: int = int(os.getenv("API_1C_MIN_IN_FLIGHT", "1"))
+    API_1C_TARGET_LATENCY: float = float(os.getenv("API_1C_TARGET_LATENCY", "5"))  # seconds
+    API_1C_BREAKER_THRESHOLD: int = int(os.getenv("API_1C_BREAKER_THRESHOLD", "5"))  # consecutive failures
+    API_1C_BREAKER_COOLDOWN: int = int(os.getenv("API_1C_BREAKER_COOLDOWN", "30"))  # seconds
+    API_1C_HEALTH_URL: str = os.getenv("API_1C_HEALTH_URL", "")
+    API_1C_BATCH_URL: str = os.getenv("API_1C_BATCH_URL", "")  # empty = one request per file
+    API_1C_BATCH_MAX_ITEMS: int = int(os.getenv("API_1C_BATCH_MAX_ITEMS", "20"))
+    API_1C_BATCH_MAX_BYTES: int = int(os.getenv("API_1C_BATCH_MAX_BYTES", str(20 * 1024 * 1024)))
+    API_1C_HTTP2: bool = os.getenv("API_1C_HTTP2", "false").lower() == "true"
+    API_1C_MAX_CONNECTIONS: int = int(os.getenv("API_1C_MAX_CONNECTIONS", "10"))
+    API_1C_MAX_KEEPALIVE: int = int(os.getenv("API_1C_MAX_KEEPALIVE", "5"))
+    API_1C_KEEPALIVE_EXPIRY: float = float(os.getenv("API_1C_KEEPALIVE_EXPIRY", "30"))  # seconds
+    
+    # Integrator
+    INTEGRATOR_WORKERS: int = int(os.getenv("INTEGRATOR_WORKERS", "4"))
+    INTEGRATOR_POLL_INTERVAL: int = int(os.getenv("INTEGRATOR_POLL_INTERVAL", "5"))  # seconds
+    INTEGRATOR_BATCH_SIZE: int = int(os.getenv("INTEGRATOR_BATCH_SIZE", "100"))  # records per poll
+    INTEGRATOR_LEASE_SECONDS: int = int(os.getenv("INTEGRATOR_LEASE_SECONDS", "120"))
     
     # SMTP
     SMTP_HOST: str = os.getenv("SMTP_HOST", "smtp.gmail.com")
@@ -29,18 +83,63 @@ class Settings:
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
     SMTP_FROM: str = os.getenv("SMTP_FROM", "noreply@it-mydoc.ru")
     SMTP_USE_TLS: bool = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+    SMTP_TIMEOUT: int = int(os.getenv("SMTP_TIMEOUT", "30"))
+    SMTP_POOL_SIZE: int = int(os.getenv("SMTP_POOL_SIZE", "2"))
+    SMTP_QUEUE_SIZE: int = int(os.getenv("SMTP_QUEUE_SIZE", "1000"))
+    SMTP_RATE_PER_MINUTE: float = float(os.getenv("SMTP_RATE_PER_MINUTE", "30"))
+    SMTP_MAX_MESSAGES_PER_CONNECTION: int = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+    MAIL_POLL_INTERVAL: int = int(os.getenv("MAIL_POLL_INTERVAL", "5"))  # seconds
+    MAIL_LEASE_SECONDS: int = int(os.getenv("MAIL_LEASE_SECONDS", "300"))
+    MAIL_RETRY_COUNT: int = int(os.getenv("MAIL_RETRY_COUNT", "5"))
+    MAIL_RETRY_DELAY: int = int(os.getenv("MAIL_RETRY_DELAY", "60"))  # seconds
+    MAIL_RETRY_MAX_DELAY: int = int(os.getenv("MAIL_RETRY_MAX_DELAY", "3600"))  # seconds
+    MAIL_DEDUP_WINDOW: int = int(os.getenv("MAIL_DEDUP_WINDOW", "600"))  # seconds
+    MAIL_ATTACHMENT_CACHE_MB: int = int(os.getenv("MAIL_ATTACHMENT_CACHE_MB", "64"))
     
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "changeme-secret-key-for-production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 24 hours
+    AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", "60"))  # seconds
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    BCRYPT_WORKERS: int = int(os.getenv("BCRYPT_WORKERS", "2"))
+    LOGIN_RATE_PER_MINUTE: float = float(os.getenv("LOGIN_RATE_PER_MINUTE", "6"))
+    LOGIN_BURST: int = int(os.getenv("LOGIN_BURST", "10"))
+    TRUSTED_PROXIES: str = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1")  # comma-separated
     
     # Admin
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "changeme")
     
+    # Dashboard stats
+    STATS_CACHE_TTL: int = int(os.getenv("STATS_CACHE_TTL", "60"))  # seconds
+    STATS_WINDOW_TTL: int = int(os.getenv("STATS_WINDOW_TTL", "10"))  # seconds
+    STATS_THROUGHPUT_MINUTES: int = int(os.getenv("STATS_THROUGHPUT_MINUTES", "15"))
+    TIMEZONE: str = os.getenv("TIMEZONE", "Europe/Moscow")  # clinic day for "today" counters
+    
+    # Live updates (/api/events)
+    EVENTS_QUEUE_SIZE: int = int(os.getenv("EVENTS_QUEUE_SIZE", "500"))  # per client
+    EVENTS_STATS_INTERVAL: float = float(os.getenv("EVENTS_STATS_INTERVAL", "2"))  # seconds
+    EVENTS_PING_INTERVAL: float = float(os.getenv("EVENTS_PING_INTERVAL", "15"))  # seconds
+    EVENTS_RETRY_MS: int = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+    
+    # Prometheus /metrics (empty token = local peers and TRUSTED_PROXIES only)
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    
     # Archive
     ARCHIVE_RETENTION_DAYS: int = int(os.getenv("ARCHIVE_RETENTION_DAYS", "90"))
+    
+    # Local PDF cache (0 disables)
+    PDF_CACHE_PATH: str = os.getenv("PDF_CACHE_PATH", "/data/pdf-cache")
+    PDF_CACHE_MAX_MB: int = int(os.getenv("PDF_CACHE_MAX_MB", "2048"))
+    
+    # File serving
+    FILE_SERVE_MODE: str = os.getenv("FILE_SERVE_MODE", "direct")  # direct | accel (nginx X-Accel-Redirect)
+    FILE_ACCEL_ROOT: str = os.getenv("FILE_ACCEL_ROOT", "/mnt/nas")
+    FILE_ACCEL_PREFIX: str = os.getenv("FILE_ACCEL_PREFIX", "/_nas/")
+    FILE_ACCEL_CACHE_PREFIX: str = os.getenv("FILE_ACCEL_CACHE_PREFIX", "/_pdf-cache/")
+    FILE_PATH_CACHE_SIZE: int = int(os.getenv("FILE_PATH_CACHE_SIZE", "4096"))
 
 
 settings = Settings()
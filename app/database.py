@@ -1,18 +1,90 @@
 """Database models and connection."""
-import os
+import asyncio
+import time
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text
+from pathlib import Path
+from typing import Awaitable, Callable
+from sqlalchemy import create_engine, event, inspect, text, Column, Index, Integer, BigInteger, String, DateTime, Boolean, Text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base as async_declarative_base
+from alembic import command
+from alembic.config import Config
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:////data/lis.db")
-# Convert sqlite:/// to sqlite+aiosqlite:/// for async
-ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://")
+from config import settings
+from metrics import DB_COMMIT_SECONDS, DB_WRITE_BATCH
+
+DATABASE_URL = settings.DATABASE_URL
+
+
+def to_async_url(url: str) -> str:
+    """Map a DATABASE_URL to its async driver (aiosqlite / asyncpg)."""
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    for prefix in ("postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+IS_SQLITE = ASYNC_DATABASE_URL.startswith("sqlite")
+
+if IS_SQLITE:
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        connect_args={"timeout": settings.SQLITE_BUSY_TIMEOUT / 1000}
+    )
+else:
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=True
+    )
+
+
+class TimedSession(Session):
+    """Sync session behind SessionLocal; its commits are timed for /metrics."""
+
+
+@event.listens_for(TimedSession, "before_commit")
+def start_commit_timer(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(TimedSession, "after_commit")
+def observe_commit(session):
+    """Record commit latency (flush and COMMIT) of every session, not just the write queue."""
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+
+SessionLocal = sessionmaker(
+    engine, class_=AsyncSession, sync_session_class=TimedSession, expire_on_commit=False
+)
+
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune every new SQLite connection for concurrent use."""
+        cursor = dbapi_connection.cursor()
+        # WAL: readers never block behind the writer
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT}")
+        cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={settings.SQLITE_CACHE_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
-engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
-SessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -48,6 +120,24 @@ class FileRecord(Base):
     # Ошибки
     error_message = Column(Text, nullable=True)
     retry_count = Column(Integer, default=0)
+    
+    # Планирование повторных попыток
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_attempt_at = Column(DateTime, nullable=True)
+    attempt_history = Column(Text, nullable=True)  # JSON
+    
+    # Аренда записи воркером доставки
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_file_records_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_file_records_created_id", "created_at", "id"),
+        Index("ix_file_records_status_created_id", "status", "created_at", "id"),
+        Index("ix_file_records_sent_to_1c_at", "sent_to_1c_at"),
+        Index("ix_file_records_status_lease", "status", "lease_expires_at"),
+    )
 
 
 class AuditLog(Base):
@@ -62,6 +152,51 @@ class AuditLog(Base):
     details = Column(Text, nullable=True)  # JSON
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_audit_logs_created_id", "created_at", "id"),
+        Index("ix_audit_logs_record_created_id", "record_id", "created_at", "id"),
+    )
+
+
+class FileIndex(Base):
+    """Индекс файлов в папке мониторинга: (path, size, mtime, inode) -> SHA256."""
+    __tablename__ = "file_index"
+
+    path = Column(String(512), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    inode = Column(BigInteger, nullable=False)
+    file_hash = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class EmailOutbox(Base):
+    """Исходящие письма пациентам (очередь отправки с повторами)."""
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    record_id = Column(Integer, nullable=False)  # FK to FileRecord
+    recipient = Column(String(255), nullable=False)
+    template = Column(String(50), nullable=False, default="result_ready")
+    subject = Column(String(255), nullable=True)  # None - тема шаблона
+    body = Column(Text, nullable=True)  # None - текст шаблона
+
+    # Пока письмо в очереди: "<record_id>:<recipient>:<template>", иначе NULL
+    dedup_key = Column(String(400), unique=True, nullable=True)
+
+    status = Column(String(20), default="pending")  # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_email_outbox_record_recipient", "record_id", "recipient"),
+    )
+
 
 class User(Base):
     """Пользователи системы."""
@@ -75,10 +210,135 @@ class User(Base):
     last_login = Column(DateTime, nullable=True)
 
 
+MIGRATIONS_PATH = Path(__file__).parent / "migrations"
+
+# Last revision whose schema matches databases created by create_all
+# before migrations were introduced
+BASELINE_REVISION = "0001"
+
+
+# Ключ advisory-блокировки PostgreSQL для миграций
+MIGRATION_LOCK_KEY = 720_001
+
+
+def lock_migrations(conn):
+    """Дождаться, пока другие реплики закончат миграции (только PostgreSQL).
+
+    Блокировка транзакционная и снимается при commit; реплика, дождавшаяся
+    её, видит схему уже обновлённой, и upgrade ничего не делает.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+def _upgrade_schema(conn):
+    """Применить миграции Alembic до последней версии."""
+    lock_migrations(conn)
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_PATH))
+    config.attributes["connection"] = conn
+    
+    inspector = inspect(conn)
+    if inspector.has_table("file_records") and not inspector.has_table("alembic_version"):
+        # База создана до появления миграций
+        command.stamp(config, BASELINE_REVISION)
+    
+    command.upgrade(config, "head")
+
+
 async def init_db():
     """Инициализация базы данных."""
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
+
+
+class WriteQueue:
+    """Serialized write path.
+
+    Mutations are async callables that take a session and return a value.
+    A single writer task drains the queue and runs everything waiting in
+    one transaction, so concurrent writers share commits instead of
+    fighting over the SQLite write lock. If a batch fails, its mutations
+    are retried one by one so only the offending one gets the error.
+
+    It carries the high-volume writes: audit entries, file registration
+    and outbox updates. Integrator state changes (claims, results,
+    heartbeats, lease reclaim), /api/retry and login commit on their own
+    sessions and rely on the SQLite busy timeout.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def submit(self, mutation: Callable[[AsyncSession], Awaitable]):
+        """Queue a mutation and wait until it is committed; returns its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((mutation, future))
+        return await future
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result=None, error: Exception = None):
+        # The caller may have been cancelled while its mutation ran
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _run_batch(self, batch: list):
+        DB_WRITE_BATCH.observe(len(batch))
+        try:
+            async with SessionLocal() as session:
+                results = [await mutation(session) for mutation, _ in batch]
+                await session.commit()
+        except Exception:
+            # Isolate the failing mutation
+            for mutation, future in batch:
+                try:
+                    async with SessionLocal() as session:
+                        result = await mutation(session)
+                        await session.commit()
+                    self._resolve(future, result)
+                except Exception as e:
+                    self._resolve(future, error=e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            self._resolve(future, result)
+
+    async def run(self):
+        """Writer loop."""
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < settings.DB_WRITE_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            
+            try:
+                await self._run_batch(batch)
+            except Exception as e:
+                print(f"[DB] Error in writer: {e}")
+                for _, future in batch:
+                    self._resolve(future, error=e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def start(self):
+        """Start the writer task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Drain queued mutations and stop the writer task."""
+        if self._task is not None:
+            await self.queue.join()
+            self._task.cancel()
+            self._task = None
+
+
+db_writer = WriteQueue()
 
 
 async def get_db():
@@ -0,0 +1,108 @@
+"""In-process pub/sub feeding the live UI (server-sent events)."""
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+
+from config import settings
+from stats import stats_cache
+
+
+def serialize_record(r) -> dict:
+    """FileRecord as shown in the UI (/api/records rows and record events)."""
+    return {
+        "id": r.id,
+        "order_no": r.order_no,
+        "file_name": r.file_name,
+        "status": r.status,
+        "sent_to_1c": r.sent_to_1c,
+        "sent_to_1c_at": r.sent_to_1c_at.isoformat() if r.sent_to_1c_at else None,
+        "email_sent": r.email_sent,
+        "patient_email": r.patient_email,
+        "created_at": r.created_at.isoformat(),
+        "error_message": r.error_message
+    }
+
+
+class EventBus:
+    """Fan out events to connected /api/events clients.
+
+    Event types: "record" (a full row for new records, or {"id", ...changed
+    fields} for updates), "log" (a new audit entry), "stats" (the
+    /api/stats payload, pushed when it changes) and "resync" (the client
+    fell behind and should reload). Each event is encoded once and shared
+    by all subscribers; a subscriber whose queue is full is sent "resync"
+    instead of blocking publishers.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: set = set()
+        self.last_id = 0
+        self._last_stats: Optional[dict] = None
+        self._task = None
+
+    def _encode(self, event_type: str, data) -> str:
+        self.last_id += 1
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        return f"id: {self.last_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+    def publish(self, event_type: str, data):
+        """Send an event to all subscribers (never blocks)."""
+        if not self.subscribers:
+            return
+        message = self._encode(event_type, data)
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Slow client: drop its backlog, it reloads on "resync"
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._encode("resync", {}))
+
+    def publish_record(self, record):
+        """Send the current state of a record."""
+        self.publish("record", serialize_record(record))
+
+    async def stream(self) -> AsyncIterator[str]:
+        """SSE stream for one client, with keep-alive comments."""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        try:
+            yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=settings.EVENTS_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            self.subscribers.discard(queue)
+
+    async def publish_stats(self):
+        """Push /api/stats to subscribers whenever it changes."""
+        while True:
+            await asyncio.sleep(settings.EVENTS_STATS_INTERVAL)
+            if not self.subscribers:
+                self._last_stats = None
+                continue
+            try:
+                stats = await stats_cache.get()
+            except Exception as e:
+                print(f"[Events] Failed to load stats: {e}")
+                continue
+            if stats != self._last_stats:
+                self._last_stats = stats
+                self.publish("stats", stats)
+
+    def start(self):
+        """Start the stats publisher."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.publish_stats())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+event_bus = EventBus(settings.EVENTS_QUEUE_SIZE)
@@ -0,0 +1,249 @@
+"""PDF file serving: resolved-path cache, conditional and ranged responses."""
+import os
+import re
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, NamedTuple, Optional
+from urllib.parse import quote
+
+import aiofiles
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import FileRecord
+from config import settings
+from pdfcache import pdf_cache
+
+RANGE_CHUNK_SIZE = 256 * 1024
+# How long a cached copy handed to nginx is kept from eviction
+ACCEL_PIN_SECONDS = 30
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ResolvedFile(NamedTuple):
+    path: Path
+    file_hash: str
+    file_name: str
+    source: Optional[Path] = None  # NAS location when `path` is the cached copy
+
+
+class FileLocator:
+    """Map record ids to their file on disk without a DB query per request.
+
+    Entries come from the record's persisted `file_path`; a stale entry
+    (the file was moved by another process) is dropped and re-resolved.
+    The integrator invalidates entries when it moves files.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[int, ResolvedFile]" = OrderedDict()
+
+    def invalidate(self, record_id: int):
+        """Forget the cached location of a record."""
+        self.entries.pop(record_id, None)
+
+    def _remember(self, record_id: int, resolved: ResolvedFile):
+        self.entries[record_id] = resolved
+        self.entries.move_to_end(record_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def _load(self, record_id: int, db: AsyncSession) -> ResolvedFile:
+        result = await db.execute(
+            select(FileRecord.file_path, FileRecord.file_hash, FileRecord.file_name, FileRecord.archived_at)
+            .where(FileRecord.id == record_id)
+        )
+        row = result.one_or_none()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Record not found")
+
+        path = Path(row.file_path)
+        if not path.exists() and row.archived_at:
+            # Records archived before the final location was persisted
+            path = Path(settings.NAS_ARCHIVE_PATH) / row.archived_at.strftime("%Y-%m-%d") / row.file_name
+        return ResolvedFile(path, row.file_hash, row.file_name)
+
+    async def _open(self, resolved: ResolvedFile) -> Optional[tuple]:
+        path = await pdf_cache.fetch(resolved.file_hash, resolved.path)
+        # The cached copy can be evicted right after fetch(): use the NAS file then
+        for candidate in dict.fromkeys((path, resolved.path)):
+            try:
+                return resolved._replace(path=candidate, source=resolved.path), candidate.stat()
+            except OSError:
+                continue
+        return None
+
+    async def resolve(self, record_id: int, db: AsyncSession) -> tuple:
+        """Get (ResolvedFile, stat) of the copy to serve, raising 404 if it is gone.
+
+        The served path is the local cached copy when there is one.
+        """
+        resolved = self.entries.get(record_id)
+        if resolved is not None:
+            opened = await self._open(resolved)
+            if opened is not None:
+                return opened
+            self.invalidate(record_id)
+
+        resolved = await self._load(record_id, db)
+        opened = await self._open(resolved)
+        if opened is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        self._remember(record_id, resolved)
+        return opened
+
+
+file_locator = FileLocator(settings.FILE_PATH_CACHE_SIZE)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag."""
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _if_range_matches(header: str, etag: str) -> bool:
+    """If-Range uses the strong comparison: one exact, non-weak entity tag.
+
+    A date or a weak tag never matches, so the full file is sent.
+    """
+    return header.strip() == etag
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Check If-None-Match (preferred) or If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[tuple]:
+    """Parse a single-range `bytes=` header into (start, end) inclusive.
+
+    Returns None when the header should be ignored (malformed or multiple
+    ranges, in which case the whole file is sent) and raises 416 when the
+    range cannot be satisfied.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+async def open_served(resolved: ResolvedFile):
+    """Open the file to serve, falling back to the NAS copy if the cached one is gone.
+
+    Streaming from a handle opened here keeps working if the cache evicts
+    the file while the response is being sent.
+    """
+    for path in dict.fromkeys(p for p in (resolved.path, resolved.source) if p):
+        try:
+            return await aiofiles.open(path, "rb")
+        except FileNotFoundError:
+            continue
+    raise HTTPException(status_code=404, detail="File not found")
+
+
+async def read_range(f, start: int, end: int) -> AsyncIterator[bytes]:
+    """Stream bytes start..end (inclusive) of an open file, then close it."""
+    remaining = end - start + 1
+    try:
+        await f.seek(start)
+        while remaining > 0:
+            chunk = await f.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await f.close()
+
+
+def accel_location(path: Path) -> Optional[str]:
+    """Internal nginx location for a file in the PDF cache or under FILE_ACCEL_ROOT."""
+    roots = (
+        (settings.PDF_CACHE_PATH, settings.FILE_ACCEL_CACHE_PREFIX),
+        (settings.FILE_ACCEL_ROOT, settings.FILE_ACCEL_PREFIX),
+    )
+    path = path.resolve()
+    for root, prefix in roots:
+        try:
+            relative = path.relative_to(Path(root).resolve())
+        except ValueError:
+            continue
+        return prefix.rstrip("/") + "/" + quote(relative.as_posix())
+    return None
+
+
+async def serve_file(request: Request, resolved: ResolvedFile, stat: os.stat_result) -> Response:
+    """Build the response for a PDF: 304, X-Accel-Redirect, 206 or 200."""
+    etag = f'"{resolved.file_hash}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        "Accept-Ranges": "bytes",
+    }
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    disposition = f"attachment; filename*=utf-8''{quote(resolved.file_name)}"
+
+    if settings.FILE_SERVE_MODE == "accel":
+        location = accel_location(resolved.path)
+        if location:
+            if resolved.path != resolved.source:
+                # nginx opens the cached copy after we answer
+                pdf_cache.pin(resolved.file_hash, ACCEL_PIN_SECONDS)
+            # nginx streams the file itself (sendfile, Range)
+            headers["X-Accel-Redirect"] = location
+            headers["Content-Disposition"] = disposition
+            return Response(media_type="application/pdf", headers=headers)
+
+    status_code = 200
+    start, end = 0, stat.st_size - 1
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or _if_range_matches(if_range, etag)):
+        byte_range = parse_range(range_header, stat.st_size)
+        if byte_range:
+            status_code = 206
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+
+    f = await open_served(resolved)
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Disposition"] = disposition
+    return StreamingResponse(
+        read_range(f, start, end),
+        status_code=status_code,
+        media_type="application/pdf",
+        headers=headers
+    )
@@ -1,108 +1,473 @@
 """1C Integration module."""
 import asyncio
 import base64
+import json
+import os
+import random
+import socket
+import time
 from pathlib import Path
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+import aiofiles
 import httpx
-from sqlalchemy import select
+from sqlalchemy import select, update, case, func, or_, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import FileRecord, AuditLog, SessionLocal
+from database import FileRecord, SessionLocal
 from config import settings
-from watcher import log_audit
+from audit import log_audit
+from resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from stats import stats_cache, set_status
+from files import file_locator
+from pdfcache import pdf_cache
+from events import event_bus
+from metrics import API_1C_SECONDS, DELIVERIES
 
 
-async def send_to_1c(
-    record: FileRecord,
-    db: AsyncSession,
-    retry_count: int = 0
-) -> bool:
-    """Send file to 1C via HTTP API."""
+# Lease owner name of this process
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Pauses delivery while 1C is unavailable
+_breaker = CircuitBreaker(
+    "Integrator",
+    failure_threshold=settings.API_1C_BREAKER_THRESHOLD,
+    reset_timeout=settings.API_1C_BREAKER_COOLDOWN
+)
+
+# Bounds concurrent HTTP requests to 1C across all workers, adapting to 1C load
+_limiter = AdaptiveLimiter(
+    min_limit=settings.API_1C_MIN_IN_FLIGHT,
+    max_limit=settings.API_1C_MAX_IN_FLIGHT,
+    target_latency=settings.API_1C_TARGET_LATENCY
+)
+
+# Shared pooled client, created on startup and closed on shutdown
+_client: Optional[httpx.AsyncClient] = None
+
+# Connection reuse statistics
+_client_stats = {
+    "requests": 0,
+    "connections_opened": 0,
+    "http_versions": {},
+}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared 1C HTTP client."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=settings.API_1C_TIMEOUT,
+            http2=settings.API_1C_HTTP2,
+            limits=httpx.Limits(
+                max_connections=settings.API_1C_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.API_1C_MAX_KEEPALIVE,
+                keepalive_expiry=settings.API_1C_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared 1C HTTP client."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _trace(event_name: str, info: dict):
+    """httpcore trace hook: count new TCP connections."""
+    if event_name == "connection.connect_tcp.complete":
+        _client_stats["connections_opened"] += 1
+
+
+def get_client_stats() -> dict:
+    """Get connection reuse statistics of the 1C client."""
+    requests = _client_stats["requests"]
+    opened = _client_stats["connections_opened"]
+    return {
+        "requests": requests,
+        "connections_opened": opened,
+        "connections_reused": max(requests - opened, 0),
+        "reuse_ratio": round(1 - opened / requests, 3) if requests else None,
+        "http_versions": dict(_client_stats["http_versions"]),
+        "http2_enabled": settings.API_1C_HTTP2,
+    }
+
+
+def get_connector_state() -> dict:
+    """Get circuit breaker and concurrency limiter state of the 1C connector."""
+    return {
+        "breaker": _breaker.snapshot(),
+        "limiter": _limiter.snapshot(),
+    }
+
+
+def _is_overload(response: httpx.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def _is_1c_failure(error: Exception) -> bool:
+    """Check whether an httpx error means 1C (or the path to it) failed.
+
+    Timeouts, connect and read errors count; errors raised before anything
+    is sent (an illegal header value, an unsupported URL) are local
+    configuration problems and must not open the circuit.
+    """
+    return isinstance(error, httpx.TransportError) and not isinstance(
+        error, (httpx.LocalProtocolError, httpx.UnsupportedProtocol)
+    )
+
+
+async def post_to_1c(url: str, **kwargs) -> httpx.Response:
+    """POST to 1C through the shared client.
+
+    Guarded by the circuit breaker (raises CircuitOpenError while 1C is
+    unavailable) and by the adaptive in-flight limiter.
+    """
+    if not _breaker.allow():
+        raise CircuitOpenError(
+            f"1C circuit is open, next probe in {_breaker.retry_after():.0f}s"
+        )
+    is_probe = _breaker.state == "half_open"
+    
+    endpoint = "batch" if url == settings.API_1C_BATCH_URL else "single"
     try:
-        # Read file
-        file_path = Path(record.file_path)
-        if not file_path.exists():
-            await log_audit(
-                db, record.id, "send_to_1c", "error",
-                f"File not found: {record.file_path}"
+        async with _limiter:
+            started = time.monotonic()
+            try:
+                response = await get_client().post(url, extensions={"trace": _trace}, **kwargs)
+            except Exception as e:
+                if _is_1c_failure(e):
+                    API_1C_SECONDS.labels(endpoint, "error").observe(time.monotonic() - started)
+                    _limiter.on_overload()
+                    _breaker.record_failure()
+                raise
+        
+        latency = time.monotonic() - started
+        if _is_overload(response):
+            API_1C_SECONDS.labels(endpoint, "overload").observe(latency)
+            _limiter.on_overload()
+            _breaker.record_failure()
+        else:
+            API_1C_SECONDS.labels(endpoint, "ok").observe(latency)
+            _limiter.on_success(latency)
+            _breaker.record_success()
+    finally:
+        # Local errors and cancellation record nothing: free the probe slot
+        if is_probe:
+            _breaker.release_probe()
+    
+    _client_stats["requests"] += 1
+    versions = _client_stats["http_versions"]
+    versions[response.http_version] = versions.get(response.http_version, 0) + 1
+    return response
+
+
+async def probe_health():
+    """Probe API_1C_HEALTH_URL while the circuit is half open."""
+    if not _breaker.allow():
+        return
+    try:
+        try:
+            response = await get_client().get(
+                settings.API_1C_HEALTH_URL,
+                headers={"Authorization": f"Bearer {settings.API_1C_TOKEN}"}
             )
-            return False
+        except Exception as e:
+            print(f"[Integrator] 1C health probe failed: {e}")
+            if _is_1c_failure(e):
+                _breaker.record_failure()
+            return
         
-        with open(file_path, "rb") as f:
-            file_content = f.read()
-            file_base64 = base64.b64encode(file_content).decode('utf-8')
+        if _is_overload(response):
+            print(f"[Integrator] 1C health probe failed: HTTP {response.status_code}")
+            _breaker.record_failure()
+        else:
+            _breaker.record_success()
+    finally:
+        _breaker.release_probe()
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given failed attempt (1-based)."""
+    delay = min(
+        settings.API_1C_RETRY_DELAY * 2 ** (attempt - 1),
+        settings.API_1C_RETRY_MAX_DELAY
+    )
+    # Equal jitter: keep half of the delay, randomize the other half
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def release_lease(record: FileRecord, status: str):
+    """Set the outcome status of a delivery and drop this worker's lease."""
+    set_status(record, status)
+    record.lease_owner = None
+    record.lease_expires_at = None
+
+
+def record_attempt(record: FileRecord, error: Optional[str] = None):
+    """Append an entry to the record's attempt history."""
+    history = json.loads(record.attempt_history) if record.attempt_history else []
+    history.append({
+        "at": record.last_attempt_at.isoformat(),
+        "success": error is None,
+        "error": error,
+    })
+    record.attempt_history = json.dumps(history[-20:], ensure_ascii=False)
+
+
+# Raw bytes per base64 chunk of a streamed upload (multiple of 3, no padding mid-stream)
+UPLOAD_CHUNK_SIZE = 3 * 64 * 1024
+
+
+def build_upload(record: FileRecord, file_size: int) -> tuple:
+    """Build the JSON envelope around the streamed fileBase64 field.
+
+    Returns (head, tail, content_length) so the request can be sent with
+    an exact Content-Length instead of chunked encoding.
+    """
+    envelope = json.dumps({
+        "orderNo": record.order_no,
+        "fileName": record.file_name,
+        "sendEmail": True,
+    })
+    head = (envelope[:-1] + ', "fileBase64": "').encode("utf-8")
+    tail = b'"}'
+    encoded_size = (file_size + 2) // 3 * 4
+    return head, tail, len(head) + encoded_size + len(tail)
+
+
+async def stream_upload(file_path: Path, head: bytes, tail: bytes) -> AsyncIterator[bytes]:
+    """Yield the JSON body, base64-encoding the file in chunks straight from disk."""
+    yield head
+    leftover = b""
+    async with aiofiles.open(file_path, "rb") as f:
+        while True:
+            chunk = await f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunk = leftover + chunk
+            aligned = len(chunk) - len(chunk) % 3
+            leftover = chunk[aligned:]
+            if aligned:
+                yield base64.b64encode(chunk[:aligned])
+    if leftover:
+        yield base64.b64encode(leftover)
+    yield tail
+
+
+async def mark_delivered(record: FileRecord, data: dict, db: AsyncSession):
+    """Apply a successful 1C response to the record and archive the file."""
+    # Update record
+    record.sent_to_1c = True
+    record.sent_to_1c_at = datetime.utcnow()
+    record.doc_ref_1c = data.get("docRef")
+    record.patient_email = data.get("email")
+    release_lease(record, "completed")
+    record.next_attempt_at = None
+    record_attempt(record)
+    
+    await db.commit()
+    event_bus.publish_record(record)
+    DELIVERIES.labels("delivered").inc()
+    
+    await log_audit(
+        record.id, "send_to_1c", "success",
+        f"Successfully sent to 1C. DocRef: {record.doc_ref_1c}",
+        details=str(data)
+    )
+    
+    print(f"[Integrator] ✓ Sent to 1C: {record.file_name}")
+    
+    # Archive file
+    await archive_file(record, db)
+
+
+async def mark_deferred(record: FileRecord, db: AsyncSession):
+    """Put the record back until the circuit lets a probe through (not an attempt)."""
+    release_lease(record, "pending")
+    record.next_attempt_at = datetime.utcnow() + timedelta(seconds=max(_breaker.retry_after(), 1))
+    await db.commit()
+    event_bus.publish_record(record)
+    DELIVERIES.labels("deferred").inc()
+
+
+async def mark_failed(record: FileRecord, error_msg: str, db: AsyncSession):
+    """Schedule a retry with backoff, or quarantine once retries are used up."""
+    if not _breaker.is_closed():
+        # 1C is down: reschedule without using up the record's attempts
+        record.error_message = error_msg
+        record_attempt(record, error_msg)
+        await mark_deferred(record, db)
+        await log_audit(
+            record.id, "send_to_1c", "error",
+            f"1C unavailable, delivery paused: {error_msg}"
+        )
+        return
+    
+    attempt = (record.retry_count or 0) + 1
+    record.error_message = error_msg
+    record.retry_count = attempt
+    record_attempt(record, error_msg)
+    
+    await log_audit(
+        record.id, "send_to_1c", "error",
+        f"Failed to send to 1C (attempt {attempt}): {error_msg}"
+    )
+    
+    # Retry logic
+    if attempt <= settings.API_1C_RETRY_COUNT:
+        delay = retry_delay(attempt)
+        release_lease(record, "pending")
+        record.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        await db.commit()
+        event_bus.publish_record(record)
+        DELIVERIES.labels("retry").inc()
+        print(f"[Integrator] Retry {attempt} for {record.file_name} in {delay:.0f}s")
+    else:
+        # Move to quarantine
+        release_lease(record, "failed")
+        record.next_attempt_at = None
+        await db.commit()
+        event_bus.publish_record(record)
+        DELIVERIES.labels("quarantined").inc()
+        await move_to_quarantine(record, db)
+        print(f"[Integrator] ✗ Failed after {settings.API_1C_RETRY_COUNT} attempts: {record.file_name}")
+
+
+async def send_to_1c(record: FileRecord, db: AsyncSession) -> bool:
+    """Send file to 1C via HTTP API (single attempt).
+
+    On failure the record goes back to pending with next_attempt_at set by
+    exponential backoff, or to quarantine once API_1C_RETRY_COUNT retries
+    are used up. The caller's worker slot is never held while waiting.
+    """
+    record.last_attempt_at = datetime.utcnow()
+    try:
+        # Read file (local cached copy when available)
+        file_path = await pdf_cache.fetch(record.file_hash, Path(record.file_path))
+        if not file_path.exists():
+            await mark_failed(record, f"File not found: {record.file_path}", db)
+            return False
         
-        # Prepare request
-        payload = {
-            "orderNo": record.order_no,
-            "fileBase64": file_base64,
-            "fileName": record.file_name,
-            "sendEmail": True
-        }
+        # Prepare request (file is streamed, never held in memory)
+        head, tail, content_length = build_upload(record, file_path.stat().st_size)
         
         headers = {
             "Authorization": f"Bearer {settings.API_1C_TOKEN}",
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Content-Length": str(content_length)
         }
         
         # Send request
-        async with httpx.AsyncClient(timeout=settings.API_1C_TIMEOUT) as client:
-            response = await client.post(
-                settings.API_1C_URL,
-                json=payload,
-                headers=headers
-            )
+        response = await post_to_1c(
+            settings.API_1C_URL,
+            content=stream_upload(file_path, head, tail),
+            headers=headers
+        )
         
         if response.status_code == 200:
-            data = response.json()
-            
-            # Update record
-            record.sent_to_1c = True
-            record.sent_to_1c_at = datetime.utcnow()
-            record.doc_ref_1c = data.get("docRef")
-            record.patient_email = data.get("email")
-            record.status = "completed"
-            
-            await db.commit()
-            
-            await log_audit(
-                db, record.id, "send_to_1c", "success",
-                f"Successfully sent to 1C. DocRef: {record.doc_ref_1c}",
-                details=str(data)
-            )
-            
-            print(f"[Integrator] ✓ Sent to 1C: {record.file_name}")
-            
-            # Archive file
-            await archive_file(record, db)
-            
+            await mark_delivered(record, response.json(), db)
             return True
         else:
             raise Exception(f"HTTP {response.status_code}: {response.text}")
             
+    except CircuitOpenError:
+        await mark_deferred(record, db)
+        return False
+    
     except Exception as e:
-        error_msg = str(e)
-        record.error_message = error_msg
-        record.retry_count = retry_count + 1
+        await mark_failed(record, str(e), db)
+        return False
+
+
+async def stream_batch_upload(parts: list) -> AsyncIterator[bytes]:
+    """Yield a batch JSON body: {"items": [<item>, ...]} with streamed files."""
+    yield b'{"items": ['
+    for i, (file_path, head, tail) in enumerate(parts):
+        if i:
+            yield b", "
+        async for chunk in stream_upload(file_path, head, tail):
+            yield chunk
+    yield b"]}"
+
+
+async def send_batch_to_1c(records: list, db: AsyncSession) -> int:
+    """Send several files to 1C in one request (API_1C_BATCH_URL).
+
+    The response must contain "results" in the order of the items; each
+    result is applied to its record as a single send would be, and records
+    without a valid result object are marked failed. Returns the number of
+    delivered records.
+    """
+    parts = []
+    batch = []
+    content_length = len(b'{"items": [') + len(b"]}")
+    
+    for record in records:
+        record.last_attempt_at = datetime.utcnow()
+        file_path = await pdf_cache.fetch(record.file_hash, Path(record.file_path))
+        if not file_path.exists():
+            await mark_failed(record, f"File not found: {record.file_path}", db)
+            continue
+        head, tail, item_length = build_upload(record, file_path.stat().st_size)
+        content_length += item_length + (2 if parts else 0)
+        parts.append((file_path, head, tail))
+        batch.append(record)
+    
+    if not batch:
+        return 0
+    
+    try:
+        headers = {
+            "Authorization": f"Bearer {settings.API_1C_TOKEN}",
+            "Content-Type": "application/json",
+            "Content-Length": str(content_length)
+        }
         
-        await log_audit(
-            db, record.id, "send_to_1c", "error",
-            f"Failed to send to 1C (attempt {retry_count + 1}): {error_msg}"
+        response = await post_to_1c(
+            settings.API_1C_BATCH_URL,
+            content=stream_batch_upload(parts),
+            headers=headers
         )
         
-        # Retry logic
-        if retry_count < settings.API_1C_RETRY_COUNT:
-            print(f"[Integrator] Retry {retry_count + 1} for {record.file_name}")
-            await asyncio.sleep(settings.API_1C_RETRY_DELAY * (retry_count + 1))
-            return await send_to_1c(record, db, retry_count + 1)
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}: {response.text}")
+        
+        payload = response.json()
+        results = payload.get("results") if isinstance(payload, dict) else None
+        if not isinstance(results, list):
+            raise Exception("Invalid batch response: no results list")
+        
+    except CircuitOpenError:
+        for record in batch:
+            await mark_deferred(record, db)
+        return 0
+    
+    except Exception as e:
+        for record in batch:
+            await mark_failed(record, str(e), db)
+        return 0
+    
+    if len(results) != len(batch):
+        print(f"[Integrator] Batch response has {len(results)} results for {len(batch)} items")
+    
+    delivered = 0
+    for index, record in enumerate(batch):
+        data = results[index] if index < len(results) else None
+        if not isinstance(data, dict):
+            await mark_failed(record, f"Invalid batch response item: {data!r}"[:500], db)
+        elif data.get("success", "error" not in data):
+            await mark_delivered(record, data, db)
+            delivered += 1
         else:
-            # Move to quarantine
-            record.status = "failed"
-            await db.commit()
-            await move_to_quarantine(record, db)
-            print(f"[Integrator] ✗ Failed after {settings.API_1C_RETRY_COUNT} attempts: {record.file_name}")
-            return False
+            await mark_failed(record, str(data.get("error", "Rejected by 1C")), db)
+    
+    print(f"[Integrator] Batch sent to 1C: {delivered}/{len(batch)} delivered")
+    return delivered
 
 
 async def archive_file(record: FileRecord, db: AsyncSession):
@@ -121,11 +486,13 @@ async def archive_file(record: FileRecord, db: AsyncSession):
         destination = archive_dir / record.file_name
         source.rename(destination)
         
+        record.file_path = str(destination)
         record.archived_at = datetime.utcnow()
         await db.commit()
+        file_locator.invalidate(record.id)
         
         await log_audit(
-            db, record.id, "archive", "success",
+            record.id, "archive", "success",
             f"File archived to {destination}"
         )
         
@@ -133,7 +500,7 @@ async def archive_file(record: FileRecord, db: AsyncSession):
         
     except Exception as e:
         await log_audit(
-            db, record.id, "archive", "error",
+            record.id, "archive", "error",
             f"Failed to archive: {str(e)}"
         )
 
@@ -153,6 +520,10 @@ async def move_to_quarantine(record: FileRecord, db: AsyncSession):
         destination = quarantine_dir / record.file_name
         source.rename(destination)
         
+        record.file_path = str(destination)
+        await db.commit()
+        file_locator.invalidate(record.id)
+        
         # Save error log
         error_log = destination.with_suffix('.error.txt')
         with open(error_log, 'w') as f:
@@ -162,7 +533,7 @@ async def move_to_quarantine(record: FileRecord, db: AsyncSession):
             f.write(f"Date: {datetime.now()}\n")
         
         await log_audit(
-            db, record.id, "quarantine", "success",
+            record.id, "quarantine", "success",
             f"File moved to quarantine: {destination}"
         )
         
@@ -170,41 +541,286 @@ async def move_to_quarantine(record: FileRecord, db: AsyncSession):
         
     except Exception as e:
         await log_audit(
-            db, record.id, "quarantine", "error",
+            record.id, "quarantine", "error",
             f"Failed to move to quarantine: {str(e)}"
         )
 
 
-async def process_queue():
-    """Process pending files queue."""
-    print("[Integrator] Started processing queue")
+def take_batch(queue: asyncio.Queue, first_id: int) -> list:
+    """Take more queued record ids to deliver together with first_id."""
+    record_ids = [first_id]
+    if settings.API_1C_BATCH_URL:
+        while len(record_ids) < settings.API_1C_BATCH_MAX_ITEMS and not queue.empty():
+            record_ids.append(queue.get_nowait())
+    return record_ids
+
+
+def split_by_size(records: list) -> list:
+    """Split records into batches bounded by API_1C_BATCH_MAX_BYTES of files."""
+    batches = []
+    current = []
+    current_bytes = 0
+    for record in records:
+        size = pdf_cache.cached_size(record.file_hash)
+        if size is None:
+            try:
+                size = Path(record.file_path).stat().st_size
+            except OSError:
+                size = 0
+        if current and current_bytes + size > settings.API_1C_BATCH_MAX_BYTES:
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(record)
+        current_bytes += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def claim_records(record_ids: list) -> list:
+    """Atomically lease pending records to this worker; returns the claimed ids.
+
+    The UPDATE only matches rows that are still pending, so two workers or
+    replicas never claim the same record. On PostgreSQL rows locked by a
+    concurrent claim are skipped instead of waited for.
+    """
+    now = datetime.utcnow()
+    claimable = (
+        select(FileRecord.id)
+        .where(FileRecord.id.in_(record_ids))
+        .where(FileRecord.status == "pending")
+        .where(FileRecord.sent_to_1c == False)
+        .with_for_update(skip_locked=True)
+    )
+    async with SessionLocal() as db:
+        result = await db.execute(
+            update(FileRecord)
+            .where(FileRecord.id.in_(claimable.scalar_subquery()))
+            .where(FileRecord.status == "pending")
+            .values(
+                status="processing",
+                lease_owner=WORKER_ID,
+                lease_expires_at=now + timedelta(seconds=settings.INTEGRATOR_LEASE_SECONDS),
+                heartbeat_at=now
+            )
+            .returning(FileRecord.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed = result.scalars().all()
+        await db.commit()
+    
+    for record_id in claimed:
+        stats_cache.transition("pending", "processing")
+        event_bus.publish("record", {"id": record_id, "status": "processing"})
+    return claimed
+
+
+async def heartbeat(record_ids: list):
+    """Extend the lease on records while they are being delivered."""
+    interval = settings.INTEGRATOR_LEASE_SECONDS / 3
+    while True:
+        await asyncio.sleep(interval)
+        now = datetime.utcnow()
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(FileRecord)
+                    .where(FileRecord.id.in_(record_ids))
+                    .where(FileRecord.status == "processing")
+                    .where(FileRecord.lease_owner == WORKER_ID)
+                    .values(
+                        lease_expires_at=now + timedelta(seconds=settings.INTEGRATOR_LEASE_SECONDS),
+                        heartbeat_at=now
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"[Integrator] Heartbeat failed for {record_ids}: {e}")
+
+
+async def reclaim_expired_leases() -> int:
+    """Return records whose lease expired (crashed or hung worker) to the queue.
+
+    An expired lease counts as a failed attempt, so a record that keeps
+    killing its worker is quarantined after API_1C_RETRY_COUNT retries
+    instead of being retried forever.
+    """
+    now = datetime.utcnow()
+    error = "Lease expired (worker crashed or timed out)"
+    exhausted = func.coalesce(FileRecord.retry_count, 0) + 1 > settings.API_1C_RETRY_COUNT
+    async with SessionLocal() as db:
+        result = await db.execute(
+            update(FileRecord)
+            .where(FileRecord.status == "processing")
+            .where(or_(
+                FileRecord.lease_expires_at < now,
+                # Claimed before leases existed
+                and_(
+                    FileRecord.lease_expires_at == None,
+                    FileRecord.updated_at < now - timedelta(seconds=settings.INTEGRATOR_LEASE_SECONDS)
+                )
+            ))
+            .values(
+                status=case((exhausted, "failed"), else_="pending"),
+                retry_count=func.coalesce(FileRecord.retry_count, 0) + 1,
+                error_message=error,
+                lease_owner=None,
+                lease_expires_at=None,
+                next_attempt_at=case((exhausted, None), else_=now)
+            )
+            .returning(FileRecord.id, FileRecord.status)
+            .execution_options(synchronize_session=False)
+        )
+        reclaimed = result.all()
+        await db.commit()
+        
+        for record_id, status in reclaimed:
+            if status == "failed":
+                record = await db.get(FileRecord, record_id)
+                DELIVERIES.labels("quarantined").inc()
+                await move_to_quarantine(record, db)
+                event_bus.publish_record(record)
+                await log_audit(
+                    record_id, "send_to_1c", "error",
+                    f"{error}, retries used up: quarantined"
+                )
+            else:
+                await log_audit(
+                    record_id, "send_to_1c", "info",
+                    f"{error}, record returned to the queue"
+                )
+    
+    if reclaimed:
+        stats_cache.invalidate()
+        print(f"[Integrator] Reclaimed {len(reclaimed)} records with expired leases")
+    return len(reclaimed)
+
+
+async def delivery_worker(queue: asyncio.Queue, queued: set):
+    """Take record ids from the queue and deliver them to 1C.
+
+    With API_1C_BATCH_URL set, ids already waiting in the queue are grouped
+    into batch requests; otherwise every record is sent on its own.
+    """
+    while True:
+        record_ids = take_batch(queue, await queue.get())
+        try:
+            claimed = await claim_records(record_ids)
+            if not claimed:
+                continue
+            
+            keep_alive = asyncio.create_task(heartbeat(claimed))
+            try:
+                async with SessionLocal() as db:
+                    result = await db.execute(
+                        select(FileRecord)
+                        .where(FileRecord.id.in_(claimed))
+                        .order_by(FileRecord.created_at)
+                    )
+                    records = result.scalars().all()
+                    
+                    for batch in split_by_size(records):
+                        if len(batch) == 1:
+                            await send_to_1c(batch[0], db)
+                        else:
+                            await send_batch_to_1c(batch, db)
+            finally:
+                keep_alive.cancel()
+                
+        except Exception as e:
+            print(f"[Integrator] Error delivering records {record_ids}: {e}")
+        finally:
+            for record_id in record_ids:
+                queued.discard(record_id)
+                queue.task_done()
+
+
+async def process_queue(queue: asyncio.Queue, queued: set):
+    """Feed due pending records to the delivery workers."""
+    print(f"[Integrator] Started processing queue ({settings.INTEGRATOR_WORKERS} workers)")
+    
+    loop = asyncio.get_running_loop()
+    next_reclaim = loop.time()
     
     while True:
         try:
+            if loop.time() >= next_reclaim:
+                await reclaim_expired_leases()
+                next_reclaim = loop.time() + settings.INTEGRATOR_LEASE_SECONDS / 2
+            
+            limit = settings.INTEGRATOR_BATCH_SIZE
+            
+            if not _breaker.is_closed():
+                if _breaker.state == "open":
+                    # 1C is down: nothing is dispatched until the cooldown ends
+                    await asyncio.sleep(settings.INTEGRATOR_POLL_INTERVAL)
+                    continue
+                if settings.API_1C_HEALTH_URL:
+                    await probe_health()
+                    await asyncio.sleep(settings.INTEGRATOR_POLL_INTERVAL)
+                    continue
+                # Half open without a health URL: one record is the probe
+                limit = 1
+            
             async with SessionLocal() as db:
-                # Get pending records
+                # Get pending records whose time has come
                 result = await db.execute(
-                    select(FileRecord)
+                    select(FileRecord.id)
                     .where(FileRecord.status == "pending")
+                    .where(or_(
+                        FileRecord.next_attempt_at == None,
+                        FileRecord.next_attempt_at <= datetime.utcnow()
+                    ))
                     .where(FileRecord.sent_to_1c == False)
                     .order_by(FileRecord.created_at)
+                    .limit(limit)
                 )
-                pending_records = result.scalars().all()
-                
-                for record in pending_records:
-                    record.status = "processing"
-                    await db.commit()
-                    
-                    await send_to_1c(record, db)
+                pending_ids = result.scalars().all()
             
-            await asyncio.sleep(5)  # Check queue every 5 seconds
+            for record_id in pending_ids:
+                if record_id in queued:
+                    continue
+                queued.add(record_id)
+                await queue.put(record_id)
+            
+            await asyncio.sleep(settings.INTEGRATOR_POLL_INTERVAL)
             
         except Exception as e:
             print(f"[Integrator] Error in queue processing: {e}")
             await asyncio.sleep(10)
 
 
+# Background tasks of the running integrator (kept referenced)
+_tasks: list = []
+
+
 async def start_integrator():
-    """Start the integrator."""
-    asyncio.create_task(process_queue())
+    """Start the queue feeder and the delivery workers."""
+    if _tasks:
+        return
+    get_client()
+    queue_size = settings.INTEGRATOR_WORKERS * 2
+    if settings.API_1C_BATCH_URL:
+        queue_size += settings.API_1C_BATCH_MAX_ITEMS
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    queued: set = set()
+    _tasks.append(asyncio.create_task(process_queue(queue, queued)))
+    _tasks.extend(
+        asyncio.create_task(delivery_worker(queue, queued))
+        for _ in range(settings.INTEGRATOR_WORKERS)
+    )
+
+
+async def stop_integrator():
+    """Stop the feeder and the workers, then release pooled connections.
 
+    Records claimed by a cancelled worker keep their lease and are handed
+    back by reclaim_expired_leases once it expires.
+    """
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    await close_client()
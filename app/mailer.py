@@ -1,83 +1,538 @@
 """Email sending module."""
 import asyncio
+import base64
+import random
+import time
+from collections import OrderedDict
 from typing import Optional
 from pathlib import Path
+from datetime import datetime, timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+from email.mime.base import MIMEBase
 import aiosmtplib
-from sqlalchemy.ext.asyncio import AsyncSession
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.exc import IntegrityError
 
-from database import FileRecord
+from database import FileRecord, EmailOutbox, SessionLocal, db_writer
 from config import settings
-from watcher import log_audit
-
-
-async def send_email(
-    record: FileRecord,
-    db: AsyncSession,
-    recipient: str,
-    subject: str = "Ваш результат анализа готов",
-    body: Optional[str] = None
-) -> bool:
-    """Send email with PDF attachment."""
-    try:
-        if not body:
-            body = f"""
-Здравствуйте!
-
-Ваш результат анализа (номер исследования: {record.order_no}) готов.
-
-Результаты прикреплены к данному письму.
-
-С уважением,
-Медицинский центр
-"""
-        
-        # Create message
-        message = MIMEMultipart()
-        message['From'] = settings.SMTP_FROM
-        message['To'] = recipient
-        message['Subject'] = subject
-        
-        # Add body
-        message.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        # Attach PDF
-        file_path = Path(record.file_path)
-        if file_path.exists():
-            with open(file_path, 'rb') as f:
-                pdf_attachment = MIMEApplication(f.read(), _subtype='pdf')
-                pdf_attachment.add_header(
-                    'Content-Disposition',
-                    'attachment',
-                    filename=record.file_name
-                )
-                message.attach(pdf_attachment)
-        
-        # Send email
-        await aiosmtplib.send(
-            message,
+from audit import log_audit
+from pdfcache import pdf_cache
+from resilience import RateLimiter
+from events import event_bus
+from metrics import EMAILS, MAIL_QUEUE, SMTP_SECONDS
+
+
+# Email templates: templates/email/<name>.subject.txt and <name>.body.txt
+EMAIL_TEMPLATES_PATH = Path(__file__).parent / "templates" / "email"
+
+_template_env = Environment(
+    loader=FileSystemLoader(str(EMAIL_TEMPLATES_PATH)),
+    keep_trailing_newline=True,
+    undefined=StrictUndefined
+)
+
+
+def compile_templates() -> dict:
+    """Compile all email templates once: name -> (subject, body)."""
+    compiled = {}
+    for path in EMAIL_TEMPLATES_PATH.glob("*.body.txt"):
+        name = path.name[:-len(".body.txt")]
+        compiled[name] = (
+            _template_env.get_template(f"{name}.subject.txt"),
+            _template_env.get_template(path.name),
+        )
+    return compiled
+
+
+EMAIL_TEMPLATES = compile_templates()
+
+
+def render_template(name: str, context: dict) -> tuple:
+    """Render (subject, body) of a compiled email template."""
+    if name not in EMAIL_TEMPLATES:
+        raise ValueError(f"Unknown email template: {name}")
+    subject, body = EMAIL_TEMPLATES[name]
+    return subject.render(context).strip(), body.render(context)
+
+
+class AttachmentCache:
+    """Base64-encoded PDF attachments by file sha256, LRU within a byte cap.
+
+    Resending a result (to another recipient or after a failure) reuses the
+    encoded part instead of reading and encoding the file again.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _encode(path: Path) -> str:
+        with open(path, 'rb') as f:
+            return base64.encodebytes(f.read()).decode('ascii')
+
+    async def get(self, file_hash: str, source: Path) -> Optional[str]:
+        """Encoded content of a PDF, or None if the file is missing."""
+        encoded = self.entries.get(file_hash)
+        if encoded is not None:
+            self.entries.move_to_end(file_hash)
+            self.hits += 1
+            return encoded
+
+        self.misses += 1
+        file_path = await pdf_cache.fetch(file_hash, source)
+        try:
+            encoded = await asyncio.to_thread(self._encode, file_path)
+        except FileNotFoundError:
+            return None
+
+        if file_hash not in self.entries and len(encoded) <= self.max_bytes:
+            self.entries[file_hash] = encoded
+            self.total_bytes += len(encoded)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return encoded
+
+
+attachment_cache = AttachmentCache(settings.MAIL_ATTACHMENT_CACHE_MB * 1024 * 1024)
+
+
+def pdf_part(encoded: str, file_name: str) -> MIMEBase:
+    """MIME part for an already base64-encoded PDF."""
+    part = MIMEBase('application', 'pdf')
+    part.set_payload(encoded)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=file_name)
+    return part
+
+
+async def build_message(job: dict) -> MIMEMultipart:
+    """Build the email for a queued job, with the PDF attached."""
+    subject, body = render_template(job["template"], job)
+
+    # Create message
+    message = MIMEMultipart()
+    message['From'] = settings.SMTP_FROM
+    message['To'] = job["recipient"]
+    message['Subject'] = job["subject"] or subject
+
+    # Add body
+    message.attach(MIMEText(job["body"] or body, 'plain', 'utf-8'))
+
+    # Attach PDF
+    encoded = await attachment_cache.get(job["file_hash"], Path(job["file_path"]))
+    if encoded is not None:
+        message.attach(pdf_part(encoded, job["file_name"]))
+
+    return message
+
+
+class SmtpConnection:
+    """A persistent, authenticated SMTP session, reopened when it drops.
+
+    The session is also recycled after SMTP_MAX_MESSAGES_PER_CONNECTION
+    messages, as many providers cap messages per session.
+    """
+
+    def __init__(self):
+        self.client: Optional[aiosmtplib.SMTP] = None
+        self.sent = 0
+
+    async def _connect(self):
+        await self.close()
+        self.client = aiosmtplib.SMTP(
             hostname=settings.SMTP_HOST,
             port=settings.SMTP_PORT,
-            username=settings.SMTP_USER,
-            password=settings.SMTP_PASSWORD,
-            use_tls=settings.SMTP_USE_TLS
+            username=settings.SMTP_USER or None,
+            password=settings.SMTP_PASSWORD or None,
+            use_tls=settings.SMTP_USE_TLS,
+            timeout=settings.SMTP_TIMEOUT
         )
-        
-        await log_audit(
-            db, record.id, "email_sent", "success",
-            f"Email sent to {recipient}"
+        await self.client.connect()
+        self.sent = 0
+
+    async def send(self, message: MIMEMultipart):
+        """Send a message, reconnecting once if the session is gone."""
+        if (
+            self.client is None
+            or not self.client.is_connected
+            or self.sent >= settings.SMTP_MAX_MESSAGES_PER_CONNECTION
+        ):
+            await self._connect()
+        try:
+            await self.client.send_message(message)
+        except (aiosmtplib.SMTPServerDisconnected, ConnectionError):
+            await self._connect()
+            await self.client.send_message(message)
+        self.sent += 1
+
+    async def close(self):
+        if self.client is not None:
+            try:
+                if self.client.is_connected:
+                    await self.client.quit()
+            except Exception:
+                self.client.close()
+            self.client = None
+
+
+def mail_retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given failed attempt (1-based)."""
+    delay = min(settings.MAIL_RETRY_DELAY * 2 ** (attempt - 1), settings.MAIL_RETRY_MAX_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class MailDispatcher:
+    """Durable email outbox served by a pool of SMTP sessions.
+
+    `enqueue` only records the message in the email_outbox table; a poller
+    claims due rows (leasing them for MAIL_LEASE_SECONDS, so rows left
+    behind by a crash are picked up again) into a bounded in-memory queue.
+    SMTP_POOL_SIZE workers each keep one persistent session open and send
+    through it, so a bulk run costs one handshake per worker instead of
+    one per message. Sending is capped at SMTP_RATE_PER_MINUTE across
+    workers; failures are retried with backoff up to MAIL_RETRY_COUNT
+    attempts.
+
+    A process only holds as many claimed rows as that rate can send within
+    one lease. The lease is renewed right before sending and checked when
+    the outcome is recorded: a row whose lease was taken over by another
+    claimant is left to it, so a message is not sent twice.
+    """
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.limiter = RateLimiter(
+            rate=settings.SMTP_RATE_PER_MINUTE / 60,
+            burst=settings.SMTP_POOL_SIZE
+        )
+        self._wake = asyncio.Event()
+        self._tasks: list = []
+        self.claimed: set = set()  # outbox ids queued or being sent here
+
+    async def enqueue(
+        self,
+        record: FileRecord,
+        recipient: str,
+        template: str = "result_ready",
+        subject: Optional[str] = None,
+        body: Optional[str] = None
+    ) -> tuple:
+        """Add an email to the outbox; returns (outbox_id, duplicate).
+
+        A message for the same record, recipient and template that is still
+        queued, or was sent less than MAIL_DEDUP_WINDOW seconds ago, is not
+        queued again.
+        """
+        recipient = recipient.strip().lower()
+        dedup_key = f"{record.id}:{recipient}:{template}"
+        sent_after = datetime.utcnow() - timedelta(seconds=settings.MAIL_DEDUP_WINDOW)
+
+        async def write(db):
+            result = await db.execute(
+                select(EmailOutbox.id)
+                .where(or_(
+                    EmailOutbox.dedup_key == dedup_key,
+                    and_(
+                        EmailOutbox.record_id == record.id,
+                        func.lower(EmailOutbox.recipient) == recipient,
+                        EmailOutbox.template == template,
+                        EmailOutbox.status == "sent",
+                        EmailOutbox.sent_at >= sent_after
+                    )
+                ))
+                .limit(1)
+            )
+            existing = result.scalar_one_or_none()
+            if existing is not None:
+                return existing, True
+            entry = EmailOutbox(
+                record_id=record.id,
+                recipient=recipient,
+                template=template,
+                subject=subject,
+                body=body,
+                dedup_key=dedup_key
+            )
+            db.add(entry)
+            await db.flush()
+            return entry.id, False
+
+        try:
+            outbox_id, duplicate = await db_writer.submit(write)
+        except IntegrityError:
+            # Queued concurrently by another replica
+            return None, True
+        if not duplicate:
+            self._wake.set()
+        return outbox_id, duplicate
+
+    @staticmethod
+    def lease_budget() -> int:
+        """How many messages the rate limit lets us send within one lease."""
+        return max(int(settings.SMTP_RATE_PER_MINUTE * settings.MAIL_LEASE_SECONDS / 60), 1)
+
+    @staticmethod
+    def _lease_held(job: dict):
+        """Condition matching the outbox row only while our claim on it stands."""
+        return and_(
+            EmailOutbox.id == job["outbox_id"],
+            EmailOutbox.status == "sending",
+            EmailOutbox.locked_until == job["lease"]
+        )
+
+    async def claim(self, limit: int) -> list:
+        """Lease up to `limit` due outbox rows to this process; returns jobs."""
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=settings.MAIL_LEASE_SECONDS)
+        due = or_(
+            and_(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now),
+            and_(EmailOutbox.status == "sending", EmailOutbox.locked_until < now)
+        )
+        claimable = (
+            select(EmailOutbox.id)
+            .where(due)
+            .where(EmailOutbox.id.not_in(self.claimed))
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
         )
-        
-        print(f"[Mailer] ✓ Email sent to {recipient} for order {record.order_no}")
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id.in_(claimable.scalar_subquery()))
+                .where(due)
+                .values(status="sending", locked_until=lease)
+                .returning(EmailOutbox.id)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = result.scalars().all()
+            await db.commit()
+            if not claimed:
+                return []
+
+            result = await db.execute(
+                select(EmailOutbox, FileRecord)
+                .join(FileRecord, FileRecord.id == EmailOutbox.record_id)
+                .where(EmailOutbox.id.in_(claimed))
+            )
+            jobs = [
+                {
+                    "outbox_id": entry.id,
+                    "lease": lease,
+                    "attempts": entry.attempts or 0,
+                    "record_id": record.id,
+                    "order_no": record.order_no,
+                    "file_name": record.file_name,
+                    "file_path": record.file_path,
+                    "file_hash": record.file_hash,
+                    "recipient": entry.recipient,
+                    "template": entry.template,
+                    "subject": entry.subject,
+                    "body": entry.body,
+                }
+                for entry, record in result.all()
+            ]
+
+            orphaned = set(claimed) - {job["outbox_id"] for job in jobs}
+            if orphaned:
+                await db.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_(orphaned))
+                    .values(status="failed", dedup_key=None, last_error="Record not found")
+                )
+                await db.commit()
+        return jobs
+
+    async def poll(self):
+        """Move due outbox rows into the send queue."""
+        while True:
+            free = min(
+                self.queue.maxsize - self.queue.qsize(),
+                self.lease_budget() - len(self.claimed)
+            )
+            if free > 0:
+                try:
+                    jobs = await self.claim(free)
+                except Exception as e:
+                    print(f"[Mailer] Error claiming outbox messages: {e}")
+                    jobs = []
+                for job in jobs:
+                    self.claimed.add(job["outbox_id"])
+                    self.queue.put_nowait(job)
+                if jobs and len(jobs) == free:
+                    continue
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.MAIL_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _wait_for_quota(self):
+        while not self.limiter.allow("smtp"):
+            await asyncio.sleep(self.limiter.retry_after("smtp"))
+
+    async def _renew_lease(self, job: dict) -> bool:
+        """Extend the lease right before sending; False if it has been lost.
+
+        A lease that ran out while the job waited may have been claimed
+        again elsewhere, and then the new claimant sends the message.
+        """
+        lease = datetime.utcnow() + timedelta(seconds=settings.MAIL_LEASE_SECONDS)
+
+        async def write(db):
+            result = await db.execute(
+                update(EmailOutbox).where(self._lease_held(job)).values(locked_until=lease)
+            )
+            return result.rowcount
+
+        if not await db_writer.submit(write):
+            return False
+        job["lease"] = lease
         return True
-        
-    except Exception as e:
+
+    async def _mark_sent(self, job: dict):
+        sent_at = datetime.utcnow()
+
+        async def write(db):
+            result = await db.execute(
+                update(EmailOutbox)
+                .where(self._lease_held(job))
+                .values(
+                    status="sent", sent_at=sent_at, attempts=job["attempts"] + 1,
+                    dedup_key=None, locked_until=None, last_error=None
+                )
+            )
+            if not result.rowcount:
+                print(f"[Mailer] Lease on outbox message {job['outbox_id']} ran out during sending")
+            await db.execute(
+                update(FileRecord)
+                .where(FileRecord.id == job["record_id"])
+                .values(email_sent=True, email_sent_at=sent_at, patient_email=job["recipient"])
+            )
+
+        await db_writer.submit(write)
+        EMAILS.labels("sent").inc()
+        event_bus.publish("record", {
+            "id": job["record_id"], "email_sent": True, "patient_email": job["recipient"]
+        })
+
+    async def _mark_failed(self, job: dict, error: str):
+        attempt = job["attempts"] + 1
+        values = {"attempts": attempt, "locked_until": None, "last_error": error}
+        if attempt < settings.MAIL_RETRY_COUNT:
+            delay = mail_retry_delay(attempt)
+            values.update(status="pending", next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+            print(f"[Mailer] Retry {attempt} for {job['recipient']} in {delay:.0f}s")
+            EMAILS.labels("retry").inc()
+        else:
+            values.update(status="failed", dedup_key=None)
+            print(f"[Mailer] ✗ Failed after {attempt} attempts: {job['recipient']}")
+            EMAILS.labels("failed").inc()
+
+        await db_writer.submit(lambda db: db.execute(
+            update(EmailOutbox).where(self._lease_held(job)).values(**values)
+        ))
+
+    async def _deliver(self, connection: SmtpConnection, job: dict):
+        try:
+            message = await build_message(job)
+            await self._wait_for_quota()
+            if not await self._renew_lease(job):
+                self.limiter.refund("smtp")
+                print(f"[Mailer] Lease on outbox message {job['outbox_id']} was lost, not sending")
+                return
+            started = time.monotonic()
+            try:
+                await connection.send(message)
+            except Exception:
+                SMTP_SECONDS.labels("error").observe(time.monotonic() - started)
+                raise
+            SMTP_SECONDS.labels("ok").observe(time.monotonic() - started)
+        except Exception as e:
+            await connection.close()
+            await log_audit(
+                job["record_id"], "email_sent", "error",
+                f"Failed to send email (attempt {job['attempts'] + 1}): {str(e)}"
+            )
+            await self._mark_failed(job, str(e))
+            return
+
+        await self._mark_sent(job)
         await log_audit(
-            db, record.id, "email_sent", "error",
-            f"Failed to send email: {str(e)}"
+            job["record_id"], "email_sent", "success",
+            f"Email sent to {job['recipient']}"
         )
-        print(f"[Mailer] ✗ Failed to send email: {e}")
-        return False
+        print(f"[Mailer] ✓ Email sent to {job['recipient']} for order {job['order_no']}")
+
+    async def worker(self):
+        """Send queued messages over one persistent SMTP session."""
+        connection = SmtpConnection()
+        try:
+            while True:
+                job = await self.queue.get()
+                try:
+                    await self._deliver(connection, job)
+                except Exception as e:
+                    print(f"[Mailer] Error delivering outbox message {job['outbox_id']}: {e}")
+                finally:
+                    self.claimed.discard(job["outbox_id"])
+                    self.queue.task_done()
+        finally:
+            await connection.close()
+
+    def start(self):
+        """Start the outbox poller and the SMTP workers."""
+        if self._tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=settings.SMTP_QUEUE_SIZE)
+        MAIL_QUEUE.set_function(self.queue.qsize)
+        self._tasks = [asyncio.create_task(self.poll())] + [
+            asyncio.create_task(self.worker()) for _ in range(settings.SMTP_POOL_SIZE)
+        ]
+        print(f"[Mailer] Started ({settings.SMTP_POOL_SIZE} SMTP connections)")
+
+    async def stop(self):
+        """Stop the workers and hand claimed but unsent messages back to the outbox."""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        unsent = []
+        while not self.queue.empty():
+            unsent.append(self.queue.get_nowait())
+        self.claimed.clear()
+        if unsent:
+            await db_writer.submit(lambda db: db.execute(
+                update(EmailOutbox)
+                .where(or_(*(self._lease_held(job) for job in unsent)))
+                .values(status="pending", locked_until=None)
+            ))
+
+    def snapshot(self) -> dict:
+        """Get current state for monitoring."""
+        return {
+            "queued": self.queue.qsize() if self.queue else 0,
+            "claimed": len(self.claimed),
+            "workers": max(len(self._tasks) - 1, 0),
+            "rate_limited": self.limiter.rejected,
+            "attachment_cache": {
+                "entries": len(attachment_cache.entries),
+                "bytes": attachment_cache.total_bytes,
+                "hits": attachment_cache.hits,
+                "misses": attachment_cache.misses,
+            },
+        }
+
 
+mail_dispatcher = MailDispatcher()
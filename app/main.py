@@ -1,27 +1,36 @@
 """Main FastAPI application."""
 import os
+import base64
+import binascii
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import Optional, List
-from fastapi import FastAPI, Depends, HTTPException, Request, Form, status
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Form, status
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer
 from fastapi.exceptions import HTTPException as FastAPIHTTPException
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import select, func, desc
+from sqlalchemy import select, update, desc, or_, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
-from database import init_db, get_db, FileRecord, AuditLog, User
+from database import init_db, get_db, db_writer, FileRecord, AuditLog, User
 from auth import (
     hash_password, verify_password, create_access_token,
-    get_current_user, init_admin_user
+    get_current_user, authenticate_token, check_login_rate, refund_login_rate,
+    is_local_peer, init_admin_user
 )
 from config import settings
 from watcher import start_watcher
-from integrator import start_integrator, send_to_1c
-from mailer import send_email
+from stats import STATUSES, stats_cache
+from audit import audit_sink
+from integrator import start_integrator, stop_integrator, get_client_stats, get_connector_state
+from mailer import mail_dispatcher
+from files import file_locator, serve_file
+from pdfcache import pdf_cache
+from events import event_bus, serialize_record
+from metrics import RECORDS, render as render_metrics
 
 app = FastAPI(title="ЛИС МД", description="Система управления лабораторными результатами")
 
@@ -75,6 +84,40 @@ class EmailRequest(BaseModel):
     email: str
 
 
+# Keyset pagination
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode an opaque cursor pointing after the given row."""
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor into (created_at, id)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, row_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def after_cursor(query, model, cursor: Optional[str]):
+    """Order newest first by (created_at, id) and continue after the cursor."""
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.where(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < row_id)
+        ))
+    return query.order_by(desc(model.created_at), desc(model.id))
+
+
+def set_next_cursor(response: Response, rows: list, limit: int):
+    """Expose the cursor of the next page in the X-Next-Cursor header."""
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
 # Events
 @app.on_event("startup")
 async def create_db_session():
@@ -90,6 +133,8 @@ async def startup():
 
     # Initialize database
     await init_db()
+    db_writer.start()
+    audit_sink.start()
     print("✓ Database initialized")
 
     # Create admin user
@@ -98,26 +143,47 @@ async def startup():
     print("✓ Admin user initialized")
 
     # Start background tasks
+    pdf_cache.load()
     await start_watcher()
     await start_integrator()
+    mail_dispatcher.start()
+    event_bus.start()
     print("✓ Background services started")
 
     print("✓ ЛИС МД started successfully!")
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop background services."""
+    event_bus.stop()
+    await stop_integrator()
+    await mail_dispatcher.stop()
+    await audit_sink.stop()
+    await db_writer.stop()
+
+
 # Auth endpoints
 @app.post("/api/auth/login")
-async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
-    """Login endpoint."""
+async def login(
+    request: LoginRequest,
+    http_request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """Login endpoint (failed attempts are rate limited per client IP and per username)."""
+    check_login_rate(http_request, request.username)
+
     result = await db.execute(select(User).where(User.username == request.username))
     user = result.scalar_one_or_none()
 
-    if not user or not verify_password(request.password, user.password_hash):
+    if not user or not await verify_password(request.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
         )
 
+    refund_login_rate(http_request, request.username)
+
     # Update last login
     user.last_login = datetime.utcnow()
     await db.commit()
@@ -145,88 +211,72 @@ async def verify_token(current_user: User = Depends(get_current_user)):
 
 # API endpoints
 @app.get("/api/stats")
-async def get_stats(
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Get statistics."""
-    total = await db.execute(select(func.count(FileRecord.id)))
-    total_count = total.scalar()
-    
-    completed = await db.execute(
-        select(func.count(FileRecord.id)).where(FileRecord.status == "completed")
-    )
-    completed_count = completed.scalar()
-    
-    failed = await db.execute(
-        select(func.count(FileRecord.id)).where(FileRecord.status == "failed")
-    )
-    failed_count = failed.scalar()
-    
-    pending = await db.execute(
-        select(func.count(FileRecord.id)).where(FileRecord.status == "pending")
+async def get_stats(current_user: User = Depends(get_current_user)):
+    """Get statistics (served from the in-process stats cache)."""
+    return await stats_cache.get()
+
+
+@app.get("/api/events")
+async def get_events(current_user: User = Depends(get_current_user)):
+    """Server-sent events: record changes, new audit entries and stats."""
+    return StreamingResponse(
+        event_bus.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    pending_count = pending.scalar()
-    
-    return {
-        "total": total_count,
-        "completed": completed_count,
-        "failed": failed_count,
-        "pending": pending_count
-    }
 
 
 @app.get("/api/records")
 async def get_records(
+    response: Response,
     status: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get file records."""
-    query = select(FileRecord).order_by(desc(FileRecord.created_at))
+    """Get file records.
+
+    Pass the X-Next-Cursor response header back as `cursor` to get the next
+    page; `offset` is kept for old clients and ignored with a cursor.
+    """
+    query = select(FileRecord)
     
     if status:
         query = query.where(FileRecord.status == status)
     
-    query = query.limit(limit).offset(offset)
+    query = after_cursor(query, FileRecord, cursor).limit(limit)
+    if not cursor and offset:
+        query = query.offset(offset)
     
     result = await db.execute(query)
     records = result.scalars().all()
+    set_next_cursor(response, records, limit)
     
-    return [
-        {
-            "id": r.id,
-            "order_no": r.order_no,
-            "file_name": r.file_name,
-            "status": r.status,
-            "sent_to_1c": r.sent_to_1c,
-            "sent_to_1c_at": r.sent_to_1c_at.isoformat() if r.sent_to_1c_at else None,
-            "email_sent": r.email_sent,
-            "patient_email": r.patient_email,
-            "created_at": r.created_at.isoformat(),
-            "error_message": r.error_message
-        }
-        for r in records
-    ]
+    return [serialize_record(r) for r in records]
 
 
 @app.get("/api/logs")
 async def get_logs(
+    response: Response,
     record_id: Optional[int] = None,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get audit logs."""
-    query = select(AuditLog).order_by(desc(AuditLog.created_at)).limit(limit)
+    """Get audit logs (cursor pagination as in /api/records)."""
+    query = select(AuditLog)
     
     if record_id:
         query = query.where(AuditLog.record_id == record_id)
     
+    query = after_cursor(query, AuditLog, cursor).limit(limit)
+    
     result = await db.execute(query)
     logs = result.scalars().all()
+    set_next_cursor(response, logs, limit)
     
     return [
         {
@@ -241,31 +291,76 @@ async def get_logs(
     ]
 
 
+@app.get("/api/integrator/stats")
+async def get_integrator_stats(current_user: User = Depends(get_current_user)):
+    """Get 1C connector statistics and circuit breaker state."""
+    return {"client": get_client_stats(), **get_connector_state(), "pdf_cache": pdf_cache.snapshot()}
+
+
+@app.get("/api/mail/stats")
+async def get_mail_stats(current_user: User = Depends(get_current_user)):
+    """Get mail dispatcher state: SMTP queue, rate limiting and attachment cache."""
+    return mail_dispatcher.snapshot()
+
+
+@app.get("/metrics")
+async def metrics(request: Request, token: Optional[str] = Depends(HTTPBearer(auto_error=False))):
+    """Prometheus metrics (bearer METRICS_TOKEN, or local peers only when it is not set)."""
+    if settings.METRICS_TOKEN:
+        if not token or token.credentials != settings.METRICS_TOKEN:
+            # Plain 401 for scrapers, not the login redirect used for pages
+            return JSONResponse(status_code=401, content={"detail": "Invalid metrics token"})
+    elif not is_local_peer(request):
+        return JSONResponse(status_code=403, content={"detail": "Metrics are only served locally"})
+
+    counts = await stats_cache.get()
+    for record_status in STATUSES:
+        RECORDS.labels(record_status).set(counts[record_status])
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+
+# Records /api/retry may reschedule; "processing" belongs to a worker's lease
+RETRYABLE_STATUSES = ("pending", "failed", "completed")
+
+
 @app.post("/api/retry")
 async def retry_processing(
     request: RetryRequest,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Retry processing a failed record."""
+    """Retry processing a failed record (or re-send a completed one)."""
     result = await db.execute(
-        select(FileRecord).where(FileRecord.id == request.record_id)
+        select(FileRecord.status).where(FileRecord.id == request.record_id)
     )
-    record = result.scalar_one_or_none()
+    old_status = result.scalar_one_or_none()
     
-    if not record:
+    if old_status is None:
         raise HTTPException(status_code=404, detail="Record not found")
+    if old_status not in RETRYABLE_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Record is {old_status}")
     
-    # Reset status
-    record.status = "pending"
-    record.retry_count = 0
-    record.error_message = None
+    # Reset status and schedule immediate delivery, unless a worker took it meanwhile
+    result = await db.execute(
+        update(FileRecord)
+        .where(FileRecord.id == request.record_id, FileRecord.status == old_status)
+        .values(
+            status="pending", sent_to_1c=False, retry_count=0, error_message=None,
+            next_attempt_at=datetime.utcnow(), lease_owner=None, lease_expires_at=None
+        )
+        .returning(FileRecord.id)
+    )
+    if result.scalar_one_or_none() is None:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Record is being processed")
     await db.commit()
+    stats_cache.transition(old_status, "pending")
     
-    # Try to send to 1C
-    success = await send_to_1c(record, db)
+    record = await db.get(FileRecord, request.record_id, populate_existing=True)
+    event_bus.publish_record(record)
     
-    return {"success": success, "record_id": record.id}
+    return {"success": True, "record_id": record.id, "scheduled": True}
 
 
 @app.post("/api/send-email")
@@ -274,7 +369,7 @@ async def resend_email(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Resend email."""
+    """Resend email (added to the outbox; the record is updated once it is sent)."""
     result = await db.execute(
         select(FileRecord).where(FileRecord.id == request.record_id)
     )
@@ -283,47 +378,21 @@ async def resend_email(
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     
-    success = await send_email(record, db, request.email)
+    outbox_id, duplicate = await mail_dispatcher.enqueue(record, request.email)
     
-    if success:
-        record.email_sent = True
-        record.email_sent_at = datetime.utcnow()
-        record.patient_email = request.email
-        await db.commit()
-    
-    return {"success": success}
+    return {"success": True, "queued": True, "outbox_id": outbox_id, "duplicate": duplicate}
 
 
 @app.get("/api/file/{record_id}")
 async def get_file(
     record_id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get PDF file."""
-    result = await db.execute(
-        select(FileRecord).where(FileRecord.id == record_id)
-    )
-    record = result.scalar_one_or_none()
-    
-    if not record:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
-    file_path = Path(record.file_path)
-    if not file_path.exists():
-        # Try archive
-        date_str = record.archived_at.strftime("%Y-%m-%d") if record.archived_at else datetime.now().strftime("%Y-%m-%d")
-        archive_path = Path(settings.NAS_ARCHIVE_PATH) / date_str / record.file_name
-        if archive_path.exists():
-            file_path = archive_path
-        else:
-            raise HTTPException(status_code=404, detail="File not found")
-    
-    return FileResponse(
-        file_path,
-        media_type="application/pdf",
-        filename=record.file_name
-    )
+    """Get PDF file (conditional and ranged requests supported)."""
+    resolved, stat = await file_locator.resolve(record_id, db)
+    return await serve_file(request, resolved, stat)
 
 
 # Static files (no auth required)
@@ -365,18 +434,7 @@ async def get_current_user_optional(
     if not token:
         return None
 
-    try:
-        payload = jwt.decode(token.credentials, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-    except JWTError:
-        return None
-
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
-
-    return user if user else None
+    return await authenticate_token(token.credentials, db)
 
 # Web UI endpoints
 @app.get("/")
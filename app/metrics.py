@@ -0,0 +1,57 @@
+"""Prometheus metrics for the ingest, delivery and mail paths."""
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Seconds: from sub-millisecond DB commits to multi-second 1C calls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Watcher
+SCAN_SECONDS = Histogram(
+    "lis_watch_scan_seconds", "Duration of a watch directory scan",
+    buckets=LATENCY_BUCKETS
+)
+HASH_SECONDS = Histogram(
+    "lis_hash_seconds", "Time to SHA256 one file (excluding executor wait)",
+    buckets=LATENCY_BUCKETS
+)
+HASH_BYTES = Counter("lis_hash_bytes_total", "Bytes hashed")
+INGEST_QUEUE = Gauge("lis_ingest_queue_depth", "Files waiting in the ingest pipeline", ["stage"])
+FILES_REGISTERED = Counter("lis_files_registered_total", "Files registered", ["result"])  # new, duplicate
+
+# 1C
+API_1C_SECONDS = Histogram(
+    "lis_1c_request_seconds", "1C HTTP request latency",
+    ["endpoint", "outcome"], buckets=LATENCY_BUCKETS
+)
+DELIVERIES = Counter(
+    "lis_1c_deliveries_total", "Delivery attempt outcomes",
+    ["outcome"]  # delivered, retry, quarantined, deferred
+)
+RECORDS = Gauge("lis_records", "File records by status", ["status"])
+
+# Mail
+SMTP_SECONDS = Histogram(
+    "lis_smtp_send_seconds", "SMTP send latency per message",
+    ["outcome"], buckets=LATENCY_BUCKETS
+)
+EMAILS = Counter("lis_emails_total", "Email outcomes", ["outcome"])  # sent, retry, failed
+MAIL_QUEUE = Gauge("lis_mail_queue_depth", "Claimed outbox messages waiting for an SMTP worker")
+
+# Database
+DB_COMMIT_SECONDS = Histogram(
+    "lis_db_commit_seconds", "Session commit latency (flush and COMMIT), all sessions",
+    buckets=LATENCY_BUCKETS
+)
+DB_WRITE_BATCH = Histogram(
+    "lis_db_write_batch_size", "Mutations per write queue transaction",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500)
+)
+AUDIT_FLUSH_SECONDS = Histogram(
+    "lis_audit_flush_seconds", "Time to write a batch of audit entries",
+    buckets=LATENCY_BUCKETS
+)
+AUDIT_ENTRIES = Counter("lis_audit_entries_total", "Audit entries logged", ["action", "status"])
+
+
+def render() -> tuple:
+    """Current metrics in the Prometheus text format: (body, content type)."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,56 @@
+"""Alembic environment.
+
+On startup database.init_db passes its connection in
+config.attributes["connection"]; the alembic CLI connects using
+DATABASE_URL.
+"""
+import asyncio
+
+from alembic import context
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import Base, ASYNC_DATABASE_URL, IS_SQLITE, lock_migrations
+
+target_metadata = Base.metadata
+
+
+def run_migrations(connection):
+    """Run migrations on a sync connection."""
+    # Several replicas (or the CLI and a starting app) may upgrade at once
+    lock_migrations(connection)
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite cannot ALTER most things in place
+        render_as_batch=IS_SQLITE,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_async():
+    """Run migrations with a dedicated engine (alembic CLI)."""
+    engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+    async with engine.begin() as connection:
+        await connection.run_sync(run_migrations)
+    await engine.dispose()
+
+
+def run_migrations_offline():
+    """Emit SQL instead of running it (alembic upgrade --sql)."""
+    context.configure(
+        url=ASYNC_DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif context.config.attributes.get("connection") is not None:
+    run_migrations(context.config.attributes["connection"])
+else:
+    asyncio.run(run_migrations_async())
@@ -0,0 +1,67 @@
+"""Initial schema (file_records, audit_logs, users).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "file_records",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("order_no", sa.String(50), nullable=False),
+        sa.Column("file_name", sa.String(255), nullable=False),
+        sa.Column("file_hash", sa.String(64), nullable=False, unique=True),
+        sa.Column("file_path", sa.String(512)),
+        sa.Column("status", sa.String(20)),
+        sa.Column("sent_to_1c", sa.Boolean()),
+        sa.Column("sent_to_1c_at", sa.DateTime(), nullable=True),
+        sa.Column("doc_ref_1c", sa.String(255), nullable=True),
+        sa.Column("email_sent", sa.Boolean()),
+        sa.Column("email_sent_at", sa.DateTime(), nullable=True),
+        sa.Column("patient_email", sa.String(255), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("updated_at", sa.DateTime()),
+        sa.Column("archived_at", sa.DateTime(), nullable=True),
+        sa.Column("error_message", sa.Text(), nullable=True),
+        sa.Column("retry_count", sa.Integer()),
+    )
+    op.create_index("ix_file_records_id", "file_records", ["id"])
+    op.create_index("ix_file_records_order_no", "file_records", ["order_no"])
+
+    op.create_table(
+        "audit_logs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("record_id", sa.Integer(), nullable=True),
+        sa.Column("action", sa.String(50), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("message", sa.Text()),
+        sa.Column("details", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_index("ix_audit_logs_id", "audit_logs", ["id"])
+
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(50), nullable=False, unique=True),
+        sa.Column("password_hash", sa.String(255), nullable=False),
+        sa.Column("role", sa.String(20)),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("last_login", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+
+
+def downgrade():
+    op.drop_table("users")
+    op.drop_table("audit_logs")
+    op.drop_table("file_records")
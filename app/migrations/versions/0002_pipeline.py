@@ -0,0 +1,68 @@
+"""File index, retry scheduling columns and query indexes.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Idempotent: databases upgraded in place by the former create_all-based
+schema sync may already have some of these objects.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_file_records_status_next_attempt", "file_records", ["status", "next_attempt_at"]),
+    ("ix_file_records_created_id", "file_records", ["created_at", "id"]),
+    ("ix_file_records_status_created_id", "file_records", ["status", "created_at", "id"]),
+    ("ix_file_records_sent_to_1c_at", "file_records", ["sent_to_1c_at"]),
+    ("ix_audit_logs_created_id", "audit_logs", ["created_at", "id"]),
+    ("ix_audit_logs_record_created_id", "audit_logs", ["record_id", "created_at", "id"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table("file_index"):
+        op.create_table(
+            "file_index",
+            sa.Column("path", sa.String(512), primary_key=True),
+            sa.Column("size", sa.BigInteger(), nullable=False),
+            sa.Column("mtime_ns", sa.BigInteger(), nullable=False),
+            sa.Column("inode", sa.BigInteger(), nullable=False),
+            sa.Column("file_hash", sa.String(64), nullable=False),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+
+    columns = {c["name"] for c in inspector.get_columns("file_records")}
+    for name, column_type in (
+        ("next_attempt_at", sa.DateTime()),
+        ("last_attempt_at", sa.DateTime()),
+        ("attempt_history", sa.Text()),
+    ):
+        if name not in columns:
+            op.add_column("file_records", sa.Column(name, column_type, nullable=True))
+
+    existing = {
+        index["name"]
+        for table in ("file_records", "audit_logs")
+        for index in inspector.get_indexes(table)
+    }
+    for name, table, index_columns in INDEXES:
+        if name not in existing:
+            op.create_index(name, table, index_columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    with op.batch_alter_table("file_records") as batch:
+        batch.drop_column("attempt_history")
+        batch.drop_column("last_attempt_at")
+        batch.drop_column("next_attempt_at")
+    op.drop_table("file_index")
@@ -0,0 +1,28 @@
+"""Delivery lease columns for multi-worker job claiming.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("file_records", sa.Column("lease_owner", sa.String(100), nullable=True))
+    op.add_column("file_records", sa.Column("lease_expires_at", sa.DateTime(), nullable=True))
+    op.add_column("file_records", sa.Column("heartbeat_at", sa.DateTime(), nullable=True))
+    op.create_index("ix_file_records_status_lease", "file_records", ["status", "lease_expires_at"])
+
+
+def downgrade():
+    op.drop_index("ix_file_records_status_lease", table_name="file_records")
+    with op.batch_alter_table("file_records") as batch:
+        batch.drop_column("heartbeat_at")
+        batch.drop_column("lease_expires_at")
+        batch.drop_column("lease_owner")
@@ -0,0 +1,41 @@
+"""Durable email outbox.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "email_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("record_id", sa.Integer(), nullable=False),
+        sa.Column("recipient", sa.String(255), nullable=False),
+        sa.Column("template", sa.String(50), nullable=False),
+        sa.Column("subject", sa.String(255), nullable=True),
+        sa.Column("body", sa.Text(), nullable=True),
+        sa.Column("dedup_key", sa.String(400), nullable=True),
+        sa.Column("status", sa.String(20)),
+        sa.Column("attempts", sa.Integer()),
+        sa.Column("next_attempt_at", sa.DateTime()),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.UniqueConstraint("dedup_key"),
+    )
+    op.create_index("ix_email_outbox_id", "email_outbox", ["id"])
+    op.create_index("ix_email_outbox_status_next_attempt", "email_outbox", ["status", "next_attempt_at"])
+    op.create_index("ix_email_outbox_record_recipient", "email_outbox", ["record_id", "recipient"])
+
+
+def downgrade():
+    op.drop_table("email_outbox")
@@ -0,0 +1,120 @@
+"""Local stand-in for the 1C HTTP service (attachResult / attachResults).
+
+Run:  uvicorn mock_1c:app --port 8081
+Then: API_1C_URL=http://localhost:8081/lab/attachResult
+      API_1C_BATCH_URL=http://localhost:8081/lab/attachResults
+      API_1C_HEALTH_URL=http://localhost:8081/lab/health
+
+Delivery tests (tests/test_integrator.py) call it in-process:
+      pip install -r requirements-dev.txt && python -m pytest tests
+
+Behaviour is tuned with environment variables:
+  MOCK_1C_TOKEN      expected Bearer token (empty = accept any)
+  MOCK_1C_LATENCY    seconds to wait before answering
+  MOCK_1C_FAIL_RATE  share of items rejected (0..1)
+  MOCK_1C_DOWN       "true" to answer every request with 503
+  MOCK_1C_REJECT_ORDERS  comma-separated order numbers that are always rejected
+  MOCK_1C_MAX_RESULTS    answer a batch with at most this many results (0 = all)
+"""
+import asyncio
+import base64
+import binascii
+import os
+import random
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+MOCK_1C_TOKEN = os.getenv("MOCK_1C_TOKEN", "")
+MOCK_1C_LATENCY = float(os.getenv("MOCK_1C_LATENCY", "0"))
+MOCK_1C_FAIL_RATE = float(os.getenv("MOCK_1C_FAIL_RATE", "0"))
+MOCK_1C_DOWN = os.getenv("MOCK_1C_DOWN", "false").lower() == "true"
+MOCK_1C_REJECT_ORDERS = {o for o in os.getenv("MOCK_1C_REJECT_ORDERS", "").split(",") if o}
+MOCK_1C_MAX_RESULTS = int(os.getenv("MOCK_1C_MAX_RESULTS", "0"))
+
+app = FastAPI(title="1C mock")
+
+# Attached documents: orderNo -> docRef
+attached: dict = {}
+stats = {"requests": 0, "items": 0, "rejected": 0}
+
+
+def check_auth(authorization: Optional[str]):
+    """Reject requests without the expected token."""
+    if MOCK_1C_TOKEN and authorization != f"Bearer {MOCK_1C_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def attach(item: dict) -> dict:
+    """Attach one result the way the 1C handler does."""
+    order_no = item.get("orderNo")
+    if not order_no:
+        return {"success": False, "error": "Не указан номер заказа"}
+    try:
+        base64.b64decode(item.get("fileBase64", ""), validate=True)
+    except (binascii.Error, ValueError):
+        return {"success": False, "orderNo": order_no, "error": "Некорректный fileBase64"}
+    if order_no in MOCK_1C_REJECT_ORDERS or random.random() < MOCK_1C_FAIL_RATE:
+        stats["rejected"] += 1
+        return {"success": False, "orderNo": order_no, "error": "Заказ не найден"}
+    
+    already = order_no in attached
+    doc_ref = attached.setdefault(order_no, str(uuid.uuid4()))
+    stats["items"] += 1
+    return {
+        "success": True,
+        "status": "ok",
+        "orderNo": order_no,
+        "docRef": doc_ref,
+        "email": f"patient-{order_no}@example.com",
+        "alreadyAttached": already,
+    }
+
+
+async def simulate():
+    """Apply configured latency and outage."""
+    stats["requests"] += 1
+    if MOCK_1C_LATENCY:
+        await asyncio.sleep(MOCK_1C_LATENCY)
+    if MOCK_1C_DOWN:
+        raise HTTPException(status_code=503, detail="Service unavailable")
+
+
+@app.post("/lab/attachResult")
+async def attach_result(request: Request, authorization: Optional[str] = Header(None)):
+    """Single result."""
+    check_auth(authorization)
+    await simulate()
+    result = attach(await request.json())
+    if not result["success"]:
+        return JSONResponse(status_code=400, content={"error": result["error"]})
+    return result
+
+
+@app.post("/lab/attachResults")
+async def attach_results(request: Request, authorization: Optional[str] = Header(None)):
+    """Batch of results; answers in the order of the items."""
+    check_auth(authorization)
+    await simulate()
+    payload = await request.json()
+    results = [attach(item) for item in payload.get("items", [])]
+    if MOCK_1C_MAX_RESULTS:
+        # Truncated answer, as from a 1C handler that stopped half way
+        results = results[:MOCK_1C_MAX_RESULTS]
+    return {"results": results}
+
+
+@app.get("/lab/health")
+async def health():
+    """Health probe."""
+    if MOCK_1C_DOWN:
+        raise HTTPException(status_code=503, detail="Service unavailable")
+    return {"status": "ok"}
+
+
+@app.get("/lab/stats")
+async def get_stats():
+    """Counters for checking test runs."""
+    return {**stats, "attached": len(attached)}
@@ -0,0 +1,205 @@
+"""Local content-addressed cache of PDFs stored on the NAS."""
+import asyncio
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from config import settings
+
+
+def calculate_sha256(file_path: str, buffer_size: int = 1024 * 1024, copy_to: Optional[str] = None) -> str:
+    """Calculate SHA256 hash of a file, optionally copying it while reading."""
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        copy = open(copy_to, "wb") if copy_to else None
+        try:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                sha256_hash.update(view[:size])
+                if copy:
+                    copy.write(view[:size])
+        finally:
+            if copy:
+                copy.close()
+        if copy_to:
+            stat = os.fstat(f.fileno())
+            os.utime(copy_to, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return sha256_hash.hexdigest()
+
+
+class PdfCache:
+    """Read-through disk cache of PDFs keyed by sha256, with LRU eviction.
+
+    The watcher fills it while hashing a new file, so the NAS copy is read
+    once at ingest; the integrator, the mailer and /api/file then read the
+    local copy. Files that are not cached yet are copied on first use.
+    Entries are named by their hash: a copy whose content does not match
+    is discarded, and entries found on disk at startup are re-hashed on
+    first use. The total size is kept under PDF_CACHE_MAX_MB by evicting
+    the least recently used entries that are not pinned.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.unverified: set = set()
+        self.pinned: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self._fetch_locks: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path_for(self, file_hash: str) -> Path:
+        return self.root / file_hash[:2] / f"{file_hash}.pdf"
+
+    def temp_path(self) -> Path:
+        """Path for a file being written into the cache."""
+        return self.root / "tmp" / f"{uuid.uuid4().hex}.part"
+
+    def load(self):
+        """Index cached files on disk, least recently accessed first."""
+        if not self.enabled:
+            return
+        (self.root / "tmp").mkdir(parents=True, exist_ok=True)
+        for leftover in (self.root / "tmp").iterdir():
+            leftover.unlink(missing_ok=True)
+
+        found = []
+        for path in self.root.glob("??/*.pdf"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_atime, path.stem, stat.st_size))
+        for _, file_hash, size in sorted(found):
+            self.entries[file_hash] = size
+            self.total_bytes += size
+            self.unverified.add(file_hash)
+        self._evict()
+        print(f"[PdfCache] {len(self.entries)} files, {self.total_bytes // (1024 * 1024)} MB")
+
+    def _drop(self, file_hash: str):
+        size = self.entries.pop(file_hash, None)
+        if size is not None:
+            self.total_bytes -= size
+        self.unverified.discard(file_hash)
+        self.path_for(file_hash).unlink(missing_ok=True)
+
+    def _evict(self):
+        for file_hash in list(self.entries):
+            if self.total_bytes <= self.max_bytes or len(self.entries) <= 1:
+                break
+            if file_hash not in self.pinned:
+                self._drop(file_hash)
+
+    def pin(self, file_hash: str, seconds: float):
+        """Keep an entry from being evicted for a while (someone else is about to read it)."""
+        self.pinned[file_hash] = self.pinned.get(file_hash, 0) + 1
+        asyncio.get_running_loop().call_later(seconds, self._unpin, file_hash)
+
+    def _unpin(self, file_hash: str):
+        count = self.pinned.pop(file_hash, 0) - 1
+        if count > 0:
+            self.pinned[file_hash] = count
+        else:
+            self._evict()
+
+    def adopt(self, temp: Path, file_hash: str):
+        """Move a fully written temp file into the cache under its hash."""
+        if file_hash in self.entries:
+            temp.unlink(missing_ok=True)
+            return
+        target = self.path_for(file_hash)
+        target.parent.mkdir(exist_ok=True)
+        size = temp.stat().st_size
+        os.replace(temp, target)
+        self.entries[file_hash] = size
+        self.total_bytes += size
+        self._evict()
+
+    def cached_size(self, file_hash: str) -> Optional[int]:
+        """Size of a cached file, or None if it is not cached."""
+        return self.entries.get(file_hash)
+
+    async def get(self, file_hash: str) -> Optional[Path]:
+        """Local path of a cached file (verified), or None."""
+        if file_hash not in self.entries:
+            return None
+        path = self.path_for(file_hash)
+        if file_hash in self.unverified:
+            try:
+                actual = await asyncio.to_thread(calculate_sha256, path, settings.HASH_BUFFER_SIZE)
+            except OSError:
+                actual = None
+            if actual != file_hash:
+                print(f"[PdfCache] Dropping corrupt entry {file_hash[:12]}")
+                self._drop(file_hash)
+                return None
+            self.unverified.discard(file_hash)
+        self.entries.move_to_end(file_hash)
+        return path
+
+    async def fetch(self, file_hash: str, source: Path) -> Path:
+        """Path to read a PDF from: the cached copy, copying it in if needed.
+
+        Falls back to `source` when the cache is disabled or the copy fails
+        (e.g. the file is missing or has changed on the NAS).
+        """
+        if not self.enabled or not file_hash:
+            return source
+
+        cached = await self.get(file_hash)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        lock = self._fetch_locks.setdefault(file_hash, asyncio.Lock())
+        try:
+            async with lock:
+                cached = await self.get(file_hash)
+                if cached is not None:
+                    self.hits += 1
+                    return cached
+                self.misses += 1
+                temp = self.temp_path()
+                try:
+                    actual = await asyncio.to_thread(
+                        calculate_sha256, source, settings.HASH_BUFFER_SIZE, temp
+                    )
+                except OSError:
+                    temp.unlink(missing_ok=True)
+                    return source
+                if actual != file_hash:
+                    temp.unlink(missing_ok=True)
+                    print(f"[PdfCache] Content of {source.name} does not match its hash, not cached")
+                    return source
+                self.adopt(temp, file_hash)
+                return self.path_for(file_hash)
+        finally:
+            if not lock.locked():
+                self._fetch_locks.pop(file_hash, None)
+
+    def snapshot(self) -> dict:
+        """Get current state for monitoring."""
+        return {
+            "files": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+pdf_cache = PdfCache(settings.PDF_CACHE_PATH, settings.PDF_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,196 @@
+"""Circuit breaker, adaptive concurrency limiter and rate limiter."""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open."""
+
+
+class CircuitBreaker:
+    """Circuit breaker: closed -> open -> half_open -> closed.
+
+    Opens after `failure_threshold` consecutive failures. While open, calls
+    are rejected; after `reset_timeout` seconds a single probe call is let
+    through (half_open). A successful probe closes the circuit, a failed one
+    opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+        self.total_opens = 0
+        self.rejected = 0
+
+    def _refresh(self):
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self.probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Check whether a call may go through now (claims the probe when half open)."""
+        self._refresh()
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def is_closed(self) -> bool:
+        """Check whether the circuit is closed (normal operation)."""
+        self._refresh()
+        return self.state == "closed"
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe is allowed."""
+        if self.state != "open":
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        """Record a successful call."""
+        if self.state != "closed":
+            print(f"[{self.name}] Circuit closed")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        """Record a failed call."""
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.total_opens += 1
+                print(f"[{self.name}] Circuit opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+
+    def release_probe(self):
+        """Free the probe slot after a call that recorded no outcome.
+
+        Called in a `finally` after the probe call, so a probe that failed
+        locally or was cancelled does not keep the circuit half open
+        forever; harmless when an outcome was recorded.
+        """
+        self.probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        """Get current state for monitoring."""
+        self._refresh()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "total_opens": self.total_opens,
+            "rejected": self.rejected,
+        }
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter driven by latency and overload responses.
+
+    The limit grows by roughly one slot per window of fast successes and is
+    halved on overload (429/5xx/transport errors). Slow responses above
+    `target_latency` shrink it gently.
+    """
+
+    def __init__(self, min_limit: int, max_limit: int, target_latency: float):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.last_latency: Optional[float] = None
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        """Adjust the limit after a successful call."""
+        self.last_latency = latency
+        if latency > self.target_latency:
+            self.limit = max(self.min_limit, self.limit * 0.9)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        """Adjust the limit after an overload signal."""
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    def snapshot(self) -> dict:
+        """Get current state for monitoring."""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "last_latency": round(self.last_latency, 3) if self.last_latency is not None else None,
+        }
+
+
+class RateLimiter:
+    """Token-bucket rate limiter keyed by caller (e.g. client IP or username).
+
+    Each key gets a bucket of `burst` tokens refilled at `rate` tokens per
+    second; a call is allowed when a token is available. Only the
+    `max_keys` most recently used buckets are kept.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, list]" = OrderedDict()
+        self.rejected = 0
+
+    def _bucket(self, key: str) -> list:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+            self.buckets[key] = bucket
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def allow(self, key: str) -> bool:
+        """Take a token for key if one is available."""
+        bucket = self._bucket(key)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        self.rejected += 1
+        return False
+
+    def refund(self, key: str):
+        """Give back a token taken by allow() (e.g. the call turned out fine)."""
+        bucket = self._bucket(key)
+        bucket[0] = min(float(self.burst), bucket[0] + 1)
+
+    def retry_after(self, key: str) -> float:
+        """Seconds until key has a token again."""
+        bucket = self._bucket(key)
+        return max((1 - bucket[0]) / self.rate, 0.0)
@@ -0,0 +1,133 @@
+"""Cached statistics for the dashboard."""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select, func, case, and_, or_
+
+from database import FileRecord, SessionLocal
+from config import settings
+
+STATUSES = ("pending", "processing", "completed", "failed")
+
+
+class StatsCache:
+    """Status counters and time-windowed stats for /api/stats.
+
+    Status counters are loaded with one grouped query and then kept current
+    in memory by the watcher and integrator through `set_status`; they are
+    reloaded from the DB every STATS_CACHE_TTL seconds to correct any drift
+    (e.g. changes made by another process). Windowed stats are recomputed
+    at most once per STATS_WINDOW_TTL seconds, whatever the number of
+    polling dashboards.
+    """
+
+    def __init__(self):
+        self.counts: Optional[dict] = None
+        self.counts_loaded_at = 0.0
+        self.windowed: Optional[dict] = None
+        self.windowed_loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def transition(self, old: Optional[str], new: str):
+        """Apply a status change to the cached counters."""
+        if self.counts is None or old == new:
+            return
+        if old is not None:
+            self.counts[old] = max(self.counts.get(old, 0) - 1, 0)
+        self.counts[new] = self.counts.get(new, 0) + 1
+
+    def invalidate(self):
+        """Force a reload on next access.
+
+        Only the load times are reset: a get() in progress keeps serving
+        the previous values.
+        """
+        self.counts_loaded_at = float("-inf")
+        self.windowed_loaded_at = float("-inf")
+
+    async def _load_counts(self):
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(FileRecord.status, func.count(FileRecord.id))
+                .group_by(FileRecord.status)
+            )
+            counts = {status: 0 for status in STATUSES}
+            counts.update(dict(result.all()))
+        self.counts = counts
+        self.counts_loaded_at = time.monotonic()
+
+    async def _load_windowed(self):
+        now = datetime.utcnow()
+        # Local midnight of the clinic, as naive UTC like the DB columns
+        local_midnight = datetime.now(ZoneInfo(settings.TIMEZONE)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        today = local_midnight.astimezone(timezone.utc).replace(tzinfo=None)
+        hour_ago = now - timedelta(hours=1)
+        window_start = now - timedelta(minutes=settings.STATS_THROUGHPUT_MINUTES)
+
+        minutes = settings.STATS_THROUGHPUT_MINUTES
+        sent = FileRecord.sent_to_1c_at
+        created = FileRecord.created_at
+
+        def count_if(condition):
+            return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+        # Completed per minute over the window, oldest first
+        bucket_starts = [now - timedelta(minutes=minutes - i) for i in range(minutes)]
+        buckets = [
+            count_if(and_(sent >= start, sent < start + timedelta(minutes=1)))
+            for start in bucket_starts
+        ]
+
+        # Everything in one aggregate query
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(
+                    count_if(created >= today),
+                    count_if(created >= hour_ago),
+                    count_if(sent >= today),
+                    count_if(sent >= hour_ago),
+                    *buckets,
+                )
+                .where(or_(created >= min(today, hour_ago), sent >= min(today, window_start)))
+            )
+            row = result.one()
+
+        self.windowed = {
+            "received_today": row[0],
+            "received_last_hour": row[1],
+            "sent_today": row[2],
+            "sent_last_hour": row[3],
+            "throughput_per_minute": list(row[4:]),
+        }
+        self.windowed_loaded_at = time.monotonic()
+
+    async def get(self) -> dict:
+        """Get stats, reloading expired parts with a single query each."""
+        async with self._lock:
+            now = time.monotonic()
+            if self.counts is None or now - self.counts_loaded_at >= settings.STATS_CACHE_TTL:
+                await self._load_counts()
+            if self.windowed is None or now - self.windowed_loaded_at >= settings.STATS_WINDOW_TTL:
+                await self._load_windowed()
+            counts = dict(self.counts)
+            windowed = self.windowed
+
+        return {
+            "total": sum(counts.values()),
+            **{status: counts.get(status, 0) for status in STATUSES},
+            **windowed,
+        }
+
+
+stats_cache = StatsCache()
+
+
+def set_status(record: FileRecord, status: str):
+    """Change a record's status and keep the cached counters in step."""
+    stats_cache.transition(record.status, status)
+    record.status = status
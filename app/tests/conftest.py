@@ -0,0 +1,61 @@
+"""Test setup: a throwaway database and NAS folders, 1C answered by mock_1c."""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Settings are read at import time, so the environment comes first
+_root = Path(tempfile.mkdtemp(prefix="lis-test-"))
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_root / 'lis.db'}",
+    "NAS_WATCH_PATH": str(_root / "watch"),
+    "NAS_ARCHIVE_PATH": str(_root / "archive"),
+    "NAS_QUARANTINE_PATH": str(_root / "quarantine"),
+    "PDF_CACHE_MAX_MB": "0",
+    "API_1C_URL": "http://1c.test/lab/attachResult",
+    "API_1C_BATCH_URL": "http://1c.test/lab/attachResults",
+    "API_1C_TOKEN": "test-token",
+})
+(_root / "watch").mkdir()
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+# One event loop for the whole session: the engine pool and the
+# background writers are bound to the loop they were started on
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def watch_path() -> Path:
+    return _root / "watch"
+
+
+@pytest.fixture(scope="session")
+async def services(anyio_backend):
+    """Database with the schema, the DB writer and the audit sink running."""
+    from database import init_db, db_writer
+    from audit import audit_sink
+
+    await init_db()
+    db_writer.start()
+    audit_sink.start()
+    yield
+    await audit_sink.stop()
+    await db_writer.stop()
+
+
+@pytest.fixture
+async def mock_1c(services):
+    """Route the integrator's HTTP client to the mock 1C app in-process."""
+    import httpx
+    import integrator
+    import mock_1c as mock
+
+    integrator._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock.app))
+    yield mock
+    await integrator.close_client()
@@ -0,0 +1,79 @@
+"""Serving PDFs: If-Range and cache eviction while a file is served."""
+import pytest
+from starlette.requests import Request
+
+from database import SessionLocal
+from files import file_locator, serve_file
+from pdfcache import pdf_cache
+from test_integrator import make_record, order_no
+
+pytestmark = pytest.mark.anyio
+
+
+def make_request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/api/file",
+        "headers": [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()],
+    })
+
+
+async def body(response) -> bytes:
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Turn the PDF cache on for one test."""
+    monkeypatch.setattr(pdf_cache, "root", tmp_path)
+    monkeypatch.setattr(pdf_cache, "max_bytes", 1024 * 1024)
+    monkeypatch.setattr(pdf_cache, "entries", type(pdf_cache.entries)())
+    monkeypatch.setattr(pdf_cache, "total_bytes", 0)
+    monkeypatch.setattr(pdf_cache, "pinned", {})
+    pdf_cache.load()
+    return pdf_cache
+
+
+async def resolve(record_id: int):
+    async with SessionLocal() as db:
+        return await file_locator.resolve(record_id, db)
+
+
+@pytest.mark.parametrize("if_range, status", [
+    (None, 206),
+    ("{etag}", 206),
+    ("W/{etag}", 200),
+    ("*", 200),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", 200),
+])
+async def test_if_range_is_strong(services, watch_path, if_range, status):
+    record_id = await make_record(watch_path, order_no())
+    resolved, stat = await resolve(record_id)
+    headers = {"range": "bytes=0-3"}
+    if if_range:
+        headers["if_range"] = if_range.format(etag=f'"{resolved.file_hash}"')
+
+    response = await serve_file(make_request(**headers), resolved, stat)
+    assert response.status_code == status
+    assert len(await body(response)) == (4 if status == 206 else stat.st_size)
+
+
+async def test_evicted_copy_falls_back_to_nas(services, watch_path, cache):
+    resolved, stat = await resolve(await make_record(watch_path, order_no()))
+    assert resolved.path == cache.path_for(resolved.file_hash)
+    content = resolved.source.read_bytes()
+
+    cache._drop(resolved.file_hash)
+    response = await serve_file(make_request(), resolved, stat)
+    assert response.status_code == 200
+    assert await body(response) == content
+
+
+async def test_pinned_entry_is_not_evicted(services, watch_path, cache):
+    first, second = [(await resolve(await make_record(watch_path, order_no())))[0] for _ in range(2)]
+    cache.pin(first.file_hash, 60)
+    cache.max_bytes = 1
+    cache._evict()
+    assert first.path.exists()
+    assert cache.cached_size(second.file_hash) is None
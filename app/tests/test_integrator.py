@@ -0,0 +1,130 @@
+"""Single and batch delivery to the mock 1C service."""
+import hashlib
+import uuid
+from pathlib import Path
+
+import pytest
+
+from database import FileRecord, SessionLocal
+
+pytestmark = pytest.mark.anyio
+
+
+async def make_record(watch_path: Path, order_no: str) -> int:
+    """A claimed record with its PDF in the watch folder."""
+    content = b"%PDF-1.4 " + order_no.encode() + uuid.uuid4().bytes
+    path = watch_path / f"{order_no}.pdf"
+    path.write_bytes(content)
+    async with SessionLocal() as db:
+        record = FileRecord(
+            order_no=order_no,
+            file_name=path.name,
+            file_hash=hashlib.sha256(content).hexdigest(),
+            file_path=str(path),
+            status="processing",
+        )
+        db.add(record)
+        await db.commit()
+        return record.id
+
+
+async def load(record_ids: list) -> list:
+    async with SessionLocal() as db:
+        return [await db.get(FileRecord, record_id) for record_id in record_ids]
+
+
+def order_no() -> str:
+    return f"T{uuid.uuid4().hex[:8]}"
+
+
+async def test_single_delivery(mock_1c, watch_path):
+    from integrator import send_to_1c
+
+    record_id = await make_record(watch_path, order_no())
+    async with SessionLocal() as db:
+        record = await db.get(FileRecord, record_id)
+        assert await send_to_1c(record, db)
+
+    [record] = await load([record_id])
+    assert record.status == "completed"
+    assert record.sent_to_1c
+    assert record.doc_ref_1c
+    assert record.lease_owner is None
+    assert not Path(watch_path / record.file_name).exists()  # archived
+
+
+async def test_single_rejected(mock_1c, watch_path, monkeypatch):
+    from integrator import send_to_1c
+
+    rejected = order_no()
+    monkeypatch.setattr(mock_1c, "MOCK_1C_REJECT_ORDERS", {rejected})
+    record_id = await make_record(watch_path, rejected)
+    async with SessionLocal() as db:
+        record = await db.get(FileRecord, record_id)
+        assert not await send_to_1c(record, db)
+
+    [record] = await load([record_id])
+    assert record.status == "pending"
+    assert not record.sent_to_1c
+    assert record.retry_count == 1
+    assert "HTTP 400" in record.error_message
+
+
+async def test_batch_partial_results(mock_1c, watch_path, monkeypatch):
+    """A rejected item and a truncated results list fail only their records."""
+    from integrator import send_batch_to_1c
+
+    orders = [order_no() for _ in range(3)]
+    monkeypatch.setattr(mock_1c, "MOCK_1C_REJECT_ORDERS", {orders[1]})
+    monkeypatch.setattr(mock_1c, "MOCK_1C_MAX_RESULTS", 2)
+    record_ids = [await make_record(watch_path, o) for o in orders]
+
+    async with SessionLocal() as db:
+        records = await load(record_ids)
+        records = [await db.merge(record) for record in records]
+        assert await send_batch_to_1c(records, db) == 1
+
+    delivered, rejected, missing = await load(record_ids)
+    assert delivered.status == "completed" and delivered.sent_to_1c
+    assert rejected.status == "pending" and rejected.retry_count == 1
+    assert rejected.error_message == "Заказ не найден"
+    assert missing.status == "pending" and missing.retry_count == 1
+    assert "Invalid batch response item" in missing.error_message
+    for record in (delivered, rejected, missing):
+        assert record.lease_owner is None
+
+
+async def test_batch_all_delivered(mock_1c, watch_path):
+    from integrator import send_batch_to_1c
+
+    record_ids = [await make_record(watch_path, order_no()) for _ in range(3)]
+    async with SessionLocal() as db:
+        records = [await db.merge(record) for record in await load(record_ids)]
+        assert await send_batch_to_1c(records, db) == 3
+
+    assert all(record.status == "completed" for record in await load(record_ids))
+
+
+async def test_reclaim_counts_an_attempt(services, watch_path):
+    """An expired lease uses up a retry; the last one quarantines the record."""
+    from datetime import datetime, timedelta
+    from config import settings
+    from integrator import reclaim_expired_leases
+
+    fresh, exhausted = [await make_record(watch_path, order_no()) for _ in range(2)]
+    async with SessionLocal() as db:
+        for record_id, retries in ((fresh, 0), (exhausted, settings.API_1C_RETRY_COUNT)):
+            record = await db.get(FileRecord, record_id)
+            record.lease_owner = "crashed-worker"
+            record.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+            record.retry_count = retries
+        await db.commit()
+
+    assert await reclaim_expired_leases() == 2
+
+    fresh, exhausted = await load([fresh, exhausted])
+    assert fresh.status == "pending" and fresh.retry_count == 1
+    assert fresh.lease_owner is None
+    assert exhausted.status == "failed"
+    assert exhausted.next_attempt_at is None
+    assert Path(settings.NAS_QUARANTINE_PATH) in Path(exhausted.file_path).parents
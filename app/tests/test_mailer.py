@@ -0,0 +1,61 @@
+"""Outbox leases: a message is sent by one claimant only."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from database import EmailOutbox, FileRecord, SessionLocal
+from mailer import MailDispatcher
+from test_integrator import make_record, order_no
+
+pytestmark = pytest.mark.anyio
+
+
+async def queue_mail(watch_path) -> int:
+    record_id = await make_record(watch_path, order_no())
+    async with SessionLocal() as db:
+        record = await db.get(FileRecord, record_id)
+    outbox_id, duplicate = await MailDispatcher().enqueue(record, "Patient@Example.com")
+    assert not duplicate
+    return outbox_id
+
+
+async def expire(outbox_id: int):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id == outbox_id)
+            .values(locked_until=datetime.utcnow() - timedelta(seconds=1))
+        )
+        await db.commit()
+
+
+async def test_claimed_rows_are_not_claimed_again(services, watch_path):
+    outbox_id = await queue_mail(watch_path)
+    dispatcher = MailDispatcher()
+    [job] = [j for j in await dispatcher.claim(100) if j["outbox_id"] == outbox_id]
+    dispatcher.claimed.add(outbox_id)
+
+    await expire(outbox_id)
+    assert outbox_id not in [j["outbox_id"] for j in await dispatcher.claim(100)]
+
+
+async def test_expired_lease_goes_to_new_claimant(services, watch_path):
+    outbox_id = await queue_mail(watch_path)
+    first, second = MailDispatcher(), MailDispatcher()
+    [stale] = [j for j in await first.claim(100) if j["outbox_id"] == outbox_id]
+
+    await expire(outbox_id)
+    [fresh] = [j for j in await second.claim(100) if j["outbox_id"] == outbox_id]
+
+    assert not await first._renew_lease(stale)
+    assert await second._renew_lease(fresh)
+
+    await first._mark_sent(stale)
+    async with SessionLocal() as db:
+        assert (await db.get(EmailOutbox, outbox_id)).status == "sending"
+
+    await second._mark_sent(fresh)
+    async with SessionLocal() as db:
+        entry = await db.get(EmailOutbox, outbox_id)
+        assert entry.status == "sent" and entry.attempts == 1
@@ -1,99 +1,313 @@
 """File watcher module for monitoring NAS."""
 import os
 import asyncio
-import hashlib
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import select
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import FileRecord, AuditLog, SessionLocal
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from database import FileRecord, FileIndex, SessionLocal, db_writer
 from config import settings
+from stats import stats_cache
+from audit import log_audit
+from pdfcache import calculate_sha256, pdf_cache
+from events import event_bus
+from metrics import FILES_REGISTERED, HASH_BYTES, HASH_SECONDS, INGEST_QUEUE, SCAN_SECONDS
+
+
+def timed_sha256(file_path: str, buffer_size: int, copy_to: Optional[str] = None) -> tuple:
+    """calculate_sha256 returning (hash, seconds, bytes) for metrics."""
+    started = time.perf_counter()
+    file_hash = calculate_sha256(file_path, buffer_size, copy_to)
+    return file_hash, time.perf_counter() - started, os.path.getsize(file_path)
+
+
+_hash_executor: Optional[Executor] = None
 
 
-def calculate_sha256(file_path: str) -> str:
-    """Calculate SHA256 hash of a file."""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
-
-
-async def log_audit(
-    db: AsyncSession,
-    record_id: Optional[int],
-    action: str,
-    status: str,
-    message: str,
-    details: Optional[str] = None
-):
-    """Log audit entry."""
-    log = AuditLog(
-        record_id=record_id,
-        action=action,
-        status=status,
-        message=message,
-        details=details
+def get_hash_executor() -> Executor:
+    """Get the executor used for hashing (created on first use).
+
+    hashlib releases the GIL on large updates, so a thread pool already
+    hashes in parallel; a process pool is available for CPU-starved hosts.
+    """
+    global _hash_executor
+    if _hash_executor is None:
+        if settings.HASH_EXECUTOR == "process":
+            _hash_executor = ProcessPoolExecutor(max_workers=settings.HASH_WORKERS)
+        else:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=settings.HASH_WORKERS, thread_name_prefix="hash"
+            )
+    return _hash_executor
+
+
+async def hash_file(file_path: Path, copy_to: Optional[Path] = None) -> str:
+    """Calculate SHA256 hash of a file off the event loop."""
+    loop = asyncio.get_running_loop()
+    file_hash, seconds, size = await loop.run_in_executor(
+        get_hash_executor(), timed_sha256, str(file_path), settings.HASH_BUFFER_SIZE,
+        str(copy_to) if copy_to else None
     )
-    db.add(log)
-    await db.commit()
+    HASH_SECONDS.observe(seconds)
+    HASH_BYTES.inc(size)
+    return file_hash
 
 
-async def process_new_file(file_path: Path, db: AsyncSession) -> Optional[FileRecord]:
-    """Process a new PDF file."""
+async def hash_and_cache(file_path: Path) -> str:
+    """Hash a new file, filling the local PDF cache from the same read."""
+    if not pdf_cache.enabled:
+        return await hash_file(file_path)
+    temp = pdf_cache.temp_path()
     try:
+        file_hash = await hash_file(file_path, temp)
+    except Exception:
+        temp.unlink(missing_ok=True)
+        raise
+    pdf_cache.adopt(temp, file_hash)
+    return file_hash
+
+
+class IngestPipeline:
+    """Staged ingest: write-completion check -> hashing -> DB registration.
+
+    Files are offered by the directory scan or by filesystem events and stay
+    in staging until their size and mtime stop changing for
+    WATCH_STABLE_SECONDS, so PDFs still being written over SMB are never
+    hashed. Stable files go through bounded queues to the hash workers and
+    the DB insert worker; a full queue pauses the stage in front of it.
+
+    The persisted file index ((path, size, mtime, inode) -> sha256) and the
+    set of known hashes are loaded once at startup, so files already seen
+    are skipped without being read and duplicates are detected without a
+    query per file.
+    """
+
+    def __init__(self):
+        self.staging: dict = {}  # path -> ((size, mtime_ns, inode), stable_since)
+        self.hash_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        self.insert_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        self.in_flight: set = set()  # paths being hashed or registered
+        self.file_index: dict = {}  # path -> ((size, mtime_ns, inode), sha256)
+        self.known_hashes: dict = {}  # sha256 -> FileRecord.id
+
+    async def load(self, watch_path: Path):
+        """Load the file index and known hashes, pruning files that left the folder."""
+        present = {str(p) for p in watch_path.glob("*.pdf")}
+        
+        async with SessionLocal() as db:
+            result = await db.execute(select(FileRecord.file_hash, FileRecord.id))
+            self.known_hashes = dict(result.all())
+            
+            result = await db.execute(select(FileIndex))
+            stale = []
+            for entry in result.scalars():
+                if entry.path in present:
+                    identity = (entry.size, entry.mtime_ns, entry.inode)
+                    self.file_index[entry.path] = (identity, entry.file_hash)
+                else:
+                    stale.append(entry.path)
+            
+            if stale:
+                await db.execute(delete(FileIndex).where(FileIndex.path.in_(stale)))
+                await db.commit()
+        
+        print(f"[Watcher] File index loaded: {len(self.file_index)} files, {len(stale)} pruned")
+
+    def offer(self, file_path: Path):
+        """Register a candidate file for write-completion tracking."""
+        if str(file_path) in self.in_flight:
+            return
+        self.staging.setdefault(file_path, None)
+
+    def forget_missing(self, present: set):
+        """Drop in-memory index entries of files that left the folder."""
+        for path in [path for path in self.file_index if path not in present]:
+            del self.file_index[path]
+
+    async def stage(self):
+        """Promote files whose size and mtime stopped changing."""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            try:
+                now = loop.time()
+                for file_path, last in list(self.staging.items()):
+                    try:
+                        stat = file_path.stat()
+                    except FileNotFoundError:
+                        # Renamed away or deleted before completion
+                        del self.staging[file_path]
+                        continue
+                    
+                    identity = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                    
+                    # Unchanged since it was hashed: skip without reading
+                    indexed = self.file_index.get(str(file_path))
+                    if indexed and indexed[0] == identity and indexed[1] in self.known_hashes:
+                        del self.staging[file_path]
+                        continue
+                    
+                    if last is None or last[0] != identity:
+                        self.staging[file_path] = (identity, now)
+                        continue
+                    
+                    if stat.st_size > 0 and now - last[1] >= settings.WATCH_STABLE_SECONDS:
+                        del self.staging[file_path]
+                        self.in_flight.add(str(file_path))
+                        await self.hash_queue.put((file_path, identity))
+                
+            except Exception as e:
+                print(f"[Watcher] Error in staging: {e}")
+            
+            await asyncio.sleep(settings.WATCH_STABLE_CHECK_INTERVAL)
+
+    async def hash_worker(self):
+        """Hash stable files and pass them to the insert stage."""
+        while True:
+            file_path, identity = await self.hash_queue.get()
+            try:
+                indexed = self.file_index.get(str(file_path))
+                if indexed and indexed[0] == identity:
+                    file_hash = indexed[1]
+                else:
+                    file_hash = await hash_and_cache(file_path)
+                await self.insert_queue.put((file_path, identity, file_hash))
+            except Exception as e:
+                self.in_flight.discard(str(file_path))
+                await log_audit(
+                    None, "file_detected", "error",
+                    f"Error hashing file {file_path.name}: {str(e)}"
+                )
+                print(f"[Watcher] Error hashing {file_path.name}: {e}")
+            finally:
+                self.hash_queue.task_done()
+
+    async def insert_worker(self):
+        """Register hashed files in the DB, a batch per write transaction."""
+        while True:
+            batch = [await self.insert_queue.get()]
+            while len(batch) < settings.INGEST_BATCH_SIZE and not self.insert_queue.empty():
+                batch.append(self.insert_queue.get_nowait())
+            
+            # Submitted together, so the DB writer commits them at once
+            await asyncio.gather(*(self.register_safe(*item) for item in batch))
+            for _ in batch:
+                self.insert_queue.task_done()
+
+    async def register_safe(self, file_path: Path, identity: tuple, file_hash: str):
+        """Register a file, logging errors instead of raising."""
+        try:
+            await self.register(file_path, identity, file_hash)
+        except Exception as e:
+            await log_audit(
+                None, "file_detected", "error",
+                f"Error processing file {file_path.name}: {str(e)}"
+            )
+            print(f"[Watcher] Error processing {file_path.name}: {e}")
+        finally:
+            self.in_flight.discard(str(file_path))
+
+    async def _index_file(self, file_path: Path, identity: tuple, file_hash: str, db: AsyncSession):
+        """Add or update the file index entry."""
+        path = str(file_path)
+        size, mtime_ns, inode = identity
+        if path in self.file_index:
+            await db.execute(
+                update(FileIndex).where(FileIndex.path == path).values(
+                    size=size, mtime_ns=mtime_ns, inode=inode, file_hash=file_hash,
+                    updated_at=datetime.utcnow()
+                )
+            )
+        else:
+            db.add(FileIndex(path=path, size=size, mtime_ns=mtime_ns, inode=inode, file_hash=file_hash))
+
+    async def register(self, file_path: Path, identity: tuple, file_hash: str) -> Optional[int]:
+        """Register a hashed PDF file. Returns the new record id, None for duplicates."""
         # Extract order number from filename
         order_no = file_path.stem
         
-        # Calculate hash
-        file_hash = calculate_sha256(str(file_path))
+        async def insert(db: AsyncSession, existing_id: Optional[int]) -> Optional[FileRecord]:
+            record = None
+            if existing_id is None:
+                # Create new record
+                record = FileRecord(
+                    order_no=order_no,
+                    file_name=file_path.name,
+                    file_hash=file_hash,
+                    file_path=str(file_path),
+                    status="pending"
+                )
+                db.add(record)
+                await db.flush()
+            await self._index_file(file_path, identity, file_hash, db)
+            return record
         
-        # Check if file already processed (by hash)
-        result = await db.execute(
-            select(FileRecord).where(FileRecord.file_hash == file_hash)
-        )
-        existing = result.scalar_one_or_none()
+        existing_id = self.known_hashes.get(file_hash)
+        try:
+            record = await db_writer.submit(lambda db: insert(db, existing_id))
+        except IntegrityError:
+            # Registered concurrently by another process
+            async with SessionLocal() as db:
+                result = await db.execute(
+                    select(FileRecord.id).where(FileRecord.file_hash == file_hash)
+                )
+                existing_id = result.scalar_one()
+            self.known_hashes[file_hash] = existing_id
+            record = await db_writer.submit(lambda db: insert(db, existing_id))
+        
+        self.file_index[str(file_path)] = (identity, file_hash)
         
-        if existing:
+        if record is None:
+            FILES_REGISTERED.labels("duplicate").inc()
             await log_audit(
-                db, existing.id, "file_detected", "info",
+                existing_id, "file_detected", "info",
                 f"File {file_path.name} already processed (duplicate hash)"
             )
             return None
         
-        # Create new record
-        record = FileRecord(
-            order_no=order_no,
-            file_name=file_path.name,
-            file_hash=file_hash,
-            file_path=str(file_path),
-            status="pending"
-        )
-        db.add(record)
-        await db.commit()
-        await db.refresh(record)
+        record_id = record.id
+        self.known_hashes[file_hash] = record_id
+        stats_cache.transition(None, "pending")
+        FILES_REGISTERED.labels("new").inc()
+        event_bus.publish_record(record)
         
         await log_audit(
-            db, record.id, "file_detected", "success",
+            record_id, "file_detected", "success",
             f"New file detected: {file_path.name}, Order: {order_no}"
         )
         
         print(f"[Watcher] New file detected: {file_path.name} (Order: {order_no})")
-        return record
-        
-    except Exception as e:
-        await log_audit(
-            db, None, "file_detected", "error",
-            f"Error processing file {file_path.name}: {str(e)}"
-        )
-        print(f"[Watcher] Error processing {file_path.name}: {e}")
-        return None
+        return record_id
+
+    def start(self) -> list:
+        """Start pipeline stages."""
+        tasks = [asyncio.create_task(self.stage())]
+        for _ in range(settings.INGEST_HASH_WORKERS):
+            tasks.append(asyncio.create_task(self.hash_worker()))
+        tasks.append(asyncio.create_task(self.insert_worker()))
+        return tasks
+
+
+def scan_directory(watch_path: Path, pipeline: IngestPipeline):
+    """Scan directory once and offer every PDF to the pipeline."""
+    with SCAN_SECONDS.time():
+        present = set()
+        for file_path in watch_path.glob("*.pdf"):
+            present.add(str(file_path))
+            pipeline.offer(file_path)
+        pipeline.forget_missing(present)
 
 
-async def watch_directory():
-    """Watch NAS directory for new files."""
+async def watch_directory(pipeline: IngestPipeline):
+    """Watch NAS directory for new files (polling mode)."""
     watch_path = Path(settings.NAS_WATCH_PATH)
     
     # Create directory if not exists
@@ -101,19 +315,9 @@ async def watch_directory():
     
     print(f"[Watcher] Started watching: {watch_path}")
     
-    # Track processed files
-    processed_files = set()
-    
     while True:
         try:
-            async with SessionLocal() as db:
-                # Scan for PDF files
-                for file_path in watch_path.glob("*.pdf"):
-                    if file_path.name not in processed_files:
-                        record = await process_new_file(file_path, db)
-                        if record:
-                            processed_files.add(file_path.name)
-                
+            scan_directory(watch_path, pipeline)
             await asyncio.sleep(settings.WATCH_INTERVAL)
             
         except Exception as e:
@@ -121,7 +325,82 @@ async def watch_directory():
             await asyncio.sleep(settings.WATCH_INTERVAL)
 
 
+class PdfEventHandler(FileSystemEventHandler):
+    """Forward filesystem events for PDF files to the ingest pipeline."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, pipeline: IngestPipeline):
+        self.loop = loop
+        self.pipeline = pipeline
+
+    def _push(self, path: str):
+        file_path = Path(path)
+        if file_path.suffix == ".pdf":
+            # Called from the observer thread
+            self.loop.call_soon_threadsafe(self.pipeline.offer, file_path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._push(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._push(event.src_path)
+
+    def on_moved(self, event):
+        # Rename-into-place: analyzer writes a temp file, then renames it to *.pdf
+        if not event.is_directory:
+            self._push(event.dest_path)
+
+
+async def watch_directory_events(pipeline: IngestPipeline):
+    """Watch NAS directory using filesystem events.
+
+    Events give sub-second detection. CIFS mounts may drop events, so the
+    directory is also rescanned every WATCH_RECONCILE_INTERVAL seconds.
+    """
+    watch_path = Path(settings.NAS_WATCH_PATH)
+    watch_path.mkdir(parents=True, exist_ok=True)
+    
+    observer = Observer()
+    observer.schedule(
+        PdfEventHandler(asyncio.get_running_loop(), pipeline),
+        str(watch_path),
+        recursive=False
+    )
+    observer.start()
+    
+    print(f"[Watcher] Started watching (events): {watch_path}")
+    
+    try:
+        while True:
+            try:
+                # Periodic reconciliation scan
+                scan_directory(watch_path, pipeline)
+            except Exception as e:
+                print(f"[Watcher] Error in reconciliation scan: {e}")
+            await asyncio.sleep(settings.WATCH_RECONCILE_INTERVAL)
+    finally:
+        observer.stop()
+        observer.join(timeout=5)
+
+
+# Background tasks of the running watcher (kept referenced)
+_tasks: list = []
+
+
 async def start_watcher():
     """Start the file watcher."""
-    asyncio.create_task(watch_directory())
-
+    watch_path = Path(settings.NAS_WATCH_PATH)
+    watch_path.mkdir(parents=True, exist_ok=True)
+    
+    pipeline = IngestPipeline()
+    await pipeline.load(watch_path)
+    INGEST_QUEUE.labels("staging").set_function(lambda: len(pipeline.staging))
+    INGEST_QUEUE.labels("hash").set_function(pipeline.hash_queue.qsize)
+    INGEST_QUEUE.labels("insert").set_function(pipeline.insert_queue.qsize)
+    _tasks.extend(pipeline.start())
+    
+    if settings.WATCH_MODE == "polling":
+        _tasks.append(asyncio.create_task(watch_directory(pipeline)))
+    else:
+        _tasks.append(asyncio.create_task(watch_directory_events(pipeline)))